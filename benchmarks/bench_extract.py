@@ -0,0 +1,176 @@
+'''
+Time every stage of the extractor on synthetic MEA layouts and write the
+results as JSON, e.g.
+
+    python benchmarks/bench_extract.py --sizes 59 512 4096 16384 65536 -o bench.json
+    python benchmarks/bench_extract.py --compare old.json new.json
+'''
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from pathlib import Path
+
+import gdspy
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+import script
+from classify import classify_shapes, rule_layers, select_electrodes
+from gds_stream import read_shapes
+from position_io import make_records, write_positions_json
+from synthetic import ELECTRODE_LAYER, write_mea_gds
+
+DEFAULT_SIZES = (59, 512, 4096, 16384, 65536)
+
+
+class StageTimer:
+    '''
+    Records wall time and (optionally) tracemalloc peak memory for each named stage.
+    '''
+
+    def __init__(self, track_memory=True):
+        self.track_memory = track_memory
+        self.stages = []
+
+    @contextmanager
+    def stage(self, name):
+        if self.track_memory:
+            tracemalloc.start()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start
+            peak = None
+            if self.track_memory:
+                peak = tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+            self.stages.append({'stage': name, 'seconds': seconds, 'peak_bytes': peak})
+
+
+def run_case(n_electrodes, pitch, workdir, track_memory=True, shard_workers=1):
+    gds_path = os.path.join(workdir, f'MEA{n_electrodes}.gds')
+    write_mea_gds(gds_path, n_electrodes, pitch=pitch)
+    name = Path(gds_path).stem
+    timer = StageTimer(track_memory)
+
+    with timer.stage('gdspy_load'):
+        lib = gdspy.GdsLibrary(infile=gds_path)
+        mea_key = next(k for k in lib.cells if 'MEA' in k)
+        MEA = lib.cells[mea_key]
+    with timer.stage('layer_filter'):
+        polygons = [p for p in MEA.polygons if p.layers[0] == ELECTRODE_LAYER]
+        np.array([p.get_bounding_box() for p in polygons])
+    with timer.stage('stream_read'):
+        _, shapes = read_shapes(gds_path, layers=rule_layers(ELECTRODE_LAYER))
+    if shard_workers > 1:
+        with timer.stage('stream_read_sharded'):
+            read_shapes(gds_path, layers=rule_layers(ELECTRODE_LAYER), workers=shard_workers)
+    with timer.stage('classify'):
+        codes = classify_shapes(shapes, electrode_layer=ELECTRODE_LAYER)
+    with timer.stage('remove_outliers'):
+        class_boxes = list(select_electrodes(shapes, codes, electrode_layer=ELECTRODE_LAYER).values())
+    with timer.stage('dedup'):
+        centers = np.concatenate([script.dedup_centers(script.box_centers(boxes)) for boxes in class_boxes])
+    with timer.stage('adjust_electrode_positions'):
+        adjusted, _ = script.rescale_centers(centers)
+    with timer.stage('add_labels'):
+        labelled = adjusted[script.label_order(adjusted)]
+    with timer.stage('write_visualization_gds'):
+        bbox = script.write_visualization_gds(labelled, name, output_dir=workdir)
+    with timer.stage('write_json'):
+        write_positions_json(os.path.join(workdir, f'electrode_positions_{name}.json'),
+                             make_records(labelled), [bbox[:2], bbox[2:]])
+    with timer.stage('write_confirmation_gds'):
+        script.create_dots_confirmation(centers, MEA, lib, name, output_dir=workdir)
+
+    return {'n_electrodes': n_electrodes, 'extracted': len(centers), 'pitch': pitch,
+            'gds_bytes': os.path.getsize(gds_path), 'stages': timer.stages}
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=Path(__file__).resolve().parent, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_results(cases, stream=sys.stdout):
+    for case in cases:
+        print(f"MEA{case['n_electrodes']} (pitch {case['pitch']}, {case['extracted']} extracted, "
+              f"{case['gds_bytes'] / 2**20:.1f} MB GDS)", file=stream)
+        for s in case['stages']:
+            peak = '' if s['peak_bytes'] is None else f"{s['peak_bytes'] / 2**20:10.1f} MB"
+            print(f"  {s['stage']:<28}{s['seconds']:10.4f} s{peak}", file=stream)
+
+
+def compare(old_path, new_path, stream=sys.stdout):
+    '''
+    Print new/old time ratios for every (size, stage) present in both result files.
+    '''
+    def index(path):
+        with open(path) as f:
+            data = json.load(f)
+        return data, {(c['n_electrodes'], s['stage']): s['seconds'] for c in data['cases'] for s in c['stages']}
+
+    old, old_times = index(old_path)
+    new, new_times = index(new_path)
+    print(f"old: {old.get('revision')}  new: {new.get('revision')}", file=stream)
+    print(f"{'electrodes':>10}  {'stage':<28}{'old s':>10}{'new s':>10}{'ratio':>8}", file=stream)
+    for key in sorted(old_times.keys() & new_times.keys()):
+        o, n = old_times[key], new_times[key]
+        ratio = n / o if o > 0 else float('inf')
+        print(f"{key[0]:>10}  {key[1]:<28}{o:10.4f}{n:10.4f}{ratio:8.2f}", file=stream)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the electrode extractor on synthetic layouts.')
+    parser.add_argument('--sizes', type=int, nargs='+', default=list(DEFAULT_SIZES),
+                        help='electrode counts to generate (default: %(default)s)')
+    parser.add_argument('--pitch', type=float, default=200.0, help='electrode pitch (default: %(default)s)')
+    parser.add_argument('--no-memory', action='store_true',
+                        help='skip tracemalloc peak tracking, which slows down the allocation-heavy stages')
+    parser.add_argument('--shard-workers', type=int, default=os.cpu_count(),
+                        help='also time the sharded reader with this many processes, '
+                             'for files of at least 2 * gds_stream.SHARD_MIN_BYTES (default: number of CPUs)')
+    parser.add_argument('-o', '--output', default='bench_results.json',
+                        help='machine-readable results file (default: %(default)s)')
+    parser.add_argument('--compare', nargs=2, metavar=('OLD', 'NEW'),
+                        help='compare two result files instead of running the benchmark')
+    args = parser.parse_args(argv)
+
+    if args.compare:
+        compare(*args.compare)
+        return 0
+
+    cases = []
+    with tempfile.TemporaryDirectory() as workdir:
+        for n in args.sizes:
+            cases.append(run_case(n, args.pitch, workdir, track_memory=not args.no_memory,
+                                  shard_workers=args.shard_workers or 1))
+            print_results(cases[-1:])
+
+    with open(args.output, 'w') as f:
+        json.dump({
+            'revision': git_revision(),
+            'timestamp': datetime.now(timezone.utc).isoformat(),
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'gdspy': gdspy.__version__,
+            'cases': cases,
+        }, f, indent=2)
+    print(f'Results saved to {args.output}')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,73 @@
+import math
+
+import gdspy
+import numpy as np
+
+ELECTRODE_LAYER = 2
+TRACE_LAYER = 1
+
+
+def grid_centers(n_electrodes, pitch):
+    '''
+    First n_electrodes sites of the smallest near-square grid that holds them,
+    ordered row by row starting at the origin.
+    '''
+    cols = math.ceil(math.sqrt(n_electrodes))
+    rows = math.ceil(n_electrodes / cols)
+    xs, ys = np.meshgrid(np.arange(cols) * pitch, np.arange(rows) * pitch)
+    return np.column_stack((xs.ravel(), ys.ravel()))[:n_electrodes]
+
+
+def make_mea_library(n_electrodes, pitch=200.0, diameter=30.0, n_stimulus=4, n_outliers=8,
+                     n_duplicates=None, traces=True, seed=0):
+    '''
+    Build a gdspy library that looks like our real MEA layouts:
+    - round recording electrodes (alternating 60/64 points) on layer 2 in a cell named MEA_<n>,
+    - n_stimulus rectangular stimulus pads on layer 2 below the array,
+    - n_outliers odd-sized shapes on layer 2 (bond pads, markers) that remove_outliers must drop,
+    - n_duplicates electrodes drawn twice (default: 1% of the array),
+    - optionally one lead per electrode on layer 1 and an unrelated PADS cell before the MEA cell.
+    Returns (library, recording electrode centres).
+    '''
+    rng = np.random.default_rng(seed)
+    if n_duplicates is None:
+        n_duplicates = max(1, n_electrodes // 100)
+
+    lib = gdspy.GdsLibrary()
+    pads = gdspy.Cell('PADS', exclude_from_current=True)
+    pads.add(gdspy.Rectangle((0, 0), (100, 100), layer=ELECTRODE_LAYER))
+    lib.add(pads)
+
+    mea = gdspy.Cell(f'MEA_{n_electrodes}', exclude_from_current=True)
+    centers = grid_centers(n_electrodes, pitch)
+    radius = diameter / 2
+    for i, (x, y) in enumerate(centers.tolist()):
+        mea.add(gdspy.Round((x, y), radius, number_of_points=60 if i % 2 else 64, layer=ELECTRODE_LAYER))
+        if traces:
+            mea.add(gdspy.Rectangle((x - 2, y - pitch / 2), (x + 2, y - radius), layer=TRACE_LAYER))
+
+    for i in rng.choice(n_electrodes, size=min(n_duplicates, n_electrodes), replace=False).tolist():
+        mea.add(gdspy.Round(tuple(centers[i]), radius, number_of_points=64, layer=ELECTRODE_LAYER))
+
+    half = diameter / 3
+    for k in range(n_stimulus):
+        x, y = k * pitch, -pitch
+        mea.add(gdspy.Rectangle((x - half, y - half), (x + half, y + half), layer=ELECTRODE_LAYER))
+
+    extent = centers.max(axis=0)
+    for _ in range(n_outliers):
+        w, h = rng.uniform(50, 500, size=2)
+        x, y = rng.uniform(0, extent.max() + 1, size=2)
+        mea.add(gdspy.Rectangle((x, y - 2 * pitch), (x + w, y - 2 * pitch + h), layer=ELECTRODE_LAYER))
+
+    lib.add(mea)
+    return lib, centers
+
+
+def write_mea_gds(path, n_electrodes, **kwargs):
+    '''
+    Write a synthetic layout to path and return the recording electrode centres.
+    '''
+    lib, centers = make_mea_library(n_electrodes, **kwargs)
+    lib.write_gds(path)
+    return centers
@@ -0,0 +1,148 @@
+import hashlib
+import json
+import os
+import tempfile
+import zipfile
+
+import numpy as np
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'extract_electrode_positions')
+DEFAULT_MAX_BYTES = 512 * 1024 * 1024
+# bump when the meaning of the cached arrays changes
+CACHE_VERSION = 3
+
+_CHUNK_SIZE = 1 << 20
+
+
+def file_digest(file_name):
+    '''
+    SHA-256 of the file contents, read in 1 MB chunks.
+    '''
+    digest = hashlib.sha256()
+    with open(file_name, 'rb') as f:
+        for chunk in iter(lambda: f.read(_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class ExtractionCache:
+    '''
+    On-disk cache of deduplicated electrode centres and their class codes, one .npz per entry.
+    Entries are keyed on the GDS content hash plus the extraction parameters,
+    so renaming or touching a file does not invalidate them. The total size is
+    capped at max_bytes; the least recently used entries (by mtime, refreshed
+    on every hit) are evicted first.
+    '''
+
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_MAX_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+
+    def key(self, file_name, **params):
+        payload = json.dumps({'version': CACHE_VERSION, 'sha256': file_digest(file_name), **params},
+                             sort_keys=True)
+        return hashlib.sha256(payload.encode()).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, f'{key}.npz')
+
+    def get(self, key):
+        '''
+        Return (cell_name, centres, classes) for key, or None on a miss.
+        A corrupt or truncated entry counts as a miss and is removed.
+        '''
+        path = self._path(key)
+        try:
+            with np.load(path) as data:
+                cell_name, centres, classes = str(data['cell_name']), data['centres'], data['classes']
+        except (zipfile.BadZipFile, EOFError, KeyError, ValueError):
+            self._discard(path)
+            return None
+        except OSError:
+            return None
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            pass
+        return cell_name, centres, classes
+
+    @staticmethod
+    def _discard(path):
+        try:
+            os.unlink(path)
+        except OSError:
+            pass
+
+    def put(self, key, cell_name, centres, classes):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        # write next to the final path and rename so concurrent readers never see a partial entry
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                np.savez(f, cell_name=np.array(cell_name), centres=np.asarray(centres, dtype=float),
+                         classes=np.asarray(classes, dtype=np.int64))
+            os.replace(tmp_path, self._path(key))
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+        self.evict()
+
+    def _entries(self):
+        '''
+        (path, size, mtime) of every entry, oldest first.
+        '''
+        entries = []
+        if not os.path.isdir(self.cache_dir):
+            return entries
+        for name in os.listdir(self.cache_dir):
+            if not name.endswith('.npz'):
+                continue
+            path = os.path.join(self.cache_dir, name)
+            try:
+                st = os.stat(path)
+            except FileNotFoundError:
+                continue
+            entries.append((path, st.st_size, st.st_mtime))
+        entries.sort(key=lambda e: e[2])
+        return entries
+
+    def evict(self):
+        '''
+        Remove least recently used entries until the cache fits in max_bytes.
+        Returns the number of entries removed.
+        '''
+        entries = self._entries()
+        total = sum(size for _, size, _ in entries)
+        removed = 0
+        for path, size, _ in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.unlink(path)
+                removed += 1
+            except FileNotFoundError:
+                pass
+            total -= size
+        return removed
+
+    def info(self):
+        entries = self._entries()
+        return {
+            'cache_dir': self.cache_dir,
+            'entries': len(entries),
+            'total_bytes': sum(size for _, size, _ in entries),
+            'max_bytes': self.max_bytes,
+        }
+
+    def clear(self):
+        '''
+        Remove every entry. Returns the number of entries removed.
+        '''
+        removed = 0
+        for path, _, _ in self._entries():
+            try:
+                os.unlink(path)
+                removed += 1
+            except FileNotFoundError:
+                pass
+        return removed
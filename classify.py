@@ -0,0 +1,172 @@
+import numpy as np
+
+from spatial import median_spacing
+
+# electrode classes; a shape's class is its index in CLASSES, UNCLASSIFIED if no rule matches
+RECORDING, STIMULUS, REFERENCE, GROUND = 'recording', 'stimulus', 'reference', 'ground'
+CLASSES = (RECORDING, STIMULUS, REFERENCE, GROUND)
+UNCLASSIFIED = -1
+
+# classes written to the simulator JSON, recording electrodes first
+ELECTRODE_CLASSES = (RECORDING, STIMULUS)
+
+REFERENCE_LAYER = 3
+GROUND_LAYER = 4
+
+# one rule per class, tried in order; every shape gets the first class whose rule it matches
+#   layers:   GDS layers of the class, None for the electrode layer (--layer)
+#   vertices: (min, max) vertex count, None for no bound
+#   fill:     (min, max) of polygon area / bounding-box area: 1 for rectangles, about pi/4 for
+#             rounds, 0.75 for hexagons and 0.83 for octagons
+#   keep:     optional; the class is only kept for a size group of its shapes that fits the
+#             recording electrodes, see select_electrodes:
+#             min_count: at least this many shapes of that size
+#             max_ratio: at most this many shapes of that size per recording electrode
+#             max_pitch: width and height at most this many recording pitches
+#             near:      every centre within this many recording pitches of the recording array
+CLASS_RULES = (
+    (STIMULUS, {'layers': None, 'vertices': (4, 4), 'fill': (0.999, 1.001),
+                'keep': {'min_count': 2, 'max_ratio': 1.0, 'max_pitch': 1.0, 'near': 2.0}}),
+    (RECORDING, {'layers': None, 'vertices': (5, None), 'fill': (0.7, 0.9)}),
+    (REFERENCE, {'layers': (REFERENCE_LAYER,), 'vertices': (3, None), 'fill': (None, None)}),
+    (GROUND, {'layers': (GROUND_LAYER,), 'vertices': (3, None), 'fill': (None, None)}),
+)
+
+
+def rule_layers(electrode_layer=2, rules=CLASS_RULES):
+    '''
+    Every GDS layer the rules look at.
+    '''
+    layers = set()
+    for _, rule in rules:
+        layers.update((electrode_layer,) if rule['layers'] is None else rule['layers'])
+    return tuple(sorted(layers))
+
+
+def _within(values, bounds):
+    low, high = bounds
+    inside = np.ones(len(values), dtype=bool)
+    if low is not None:
+        inside &= values >= low
+    if high is not None:
+        inside &= values <= high
+    return inside
+
+
+def classify_shapes(shapes, electrode_layer=2, rules=CLASS_RULES):
+    '''
+    Class code (index into CLASSES, or UNCLASSIFIED) of every shape returned by
+    gds_stream.read_shapes, from its layer, vertex count and fill ratio. The
+    fill ratio is read from shapes['fill'] when given, as the bounding boxes of
+    shapes in rotated references are wider than the shapes themselves.
+    '''
+    boxes = shapes['boxes']
+    if 'fill' in shapes:
+        fill = shapes['fill']
+    else:
+        box_area = np.prod(boxes[:, 1] - boxes[:, 0], axis=1)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            fill = np.where(box_area > 0, shapes['area'] / box_area, 0.0)
+
+    codes = np.full(len(boxes), UNCLASSIFIED, dtype=np.int64)
+    for name, rule in rules:
+        layers = (electrode_layer,) if rule['layers'] is None else rule['layers']
+        match = ((codes == UNCLASSIFIED) & np.isin(shapes['layer'], layers)
+                 & _within(shapes['vertices'], rule['vertices']) & _within(fill, rule['fill']))
+        codes[match] = CLASSES.index(name)
+    return codes
+
+
+def _size_keys(boxes, tol):
+    return np.round((boxes[:, 1] - boxes[:, 0]) / tol).astype(np.int64)
+
+
+def size_groups(boxes, tol=1e-6):
+    '''
+    Indices of the (N, 2, 2) bounding boxes of every (width, height), comparing
+    sizes up to tol, the most common size first. Ties go to the size that
+    appears first.
+    '''
+    _, first_seen, inverse, counts = np.unique(_size_keys(boxes, tol), axis=0, return_index=True,
+                                               return_inverse=True, return_counts=True)
+    inverse = inverse.ravel()
+    order = np.argsort(inverse, kind='stable')
+    groups = np.split(order, np.cumsum(counts)[:-1])
+    return [groups[label] for label in np.lexsort((first_seen, -counts))]
+
+
+def _fits(boxes, keep, array):
+    if len(boxes) < keep.get('min_count', 1):
+        return False
+    if array is None:
+        return True
+    count, lower, upper, pitch = array
+    if 'max_ratio' in keep and len(boxes) > keep['max_ratio'] * count:
+        return False
+    if pitch is None:
+        return True
+    if 'max_pitch' in keep and np.any(boxes[0, 1] - boxes[0, 0] > keep['max_pitch'] * pitch):
+        return False
+    if 'near' in keep:
+        centers = boxes.mean(axis=1)
+        margin = keep['near'] * pitch
+        if np.any(centers < lower - margin) or np.any(centers > upper + margin):
+            return False
+    return True
+
+
+def _recording_array(boxes):
+    '''
+    (count, lower corner, upper corner, pitch) of the recording electrode
+    centres, the pitch None for a single electrode.
+    '''
+    centers = np.unique(boxes.mean(axis=1), axis=0)
+    pitch = median_spacing(centers) if len(centers) > 1 else None
+    return len(centers), centers.min(axis=0), centers.max(axis=0), pitch
+
+
+def select_electrodes(shapes, codes, electrode_layer=2, rules=CLASS_RULES, tol=1e-6):
+    '''
+    Bounding boxes of every class left after outlier removal, {class code:
+    (N, 2, 2) boxes} by class code. Recording electrodes are the recording
+    shapes of the most common size plus the shapes on the electrode layer that
+    no rule matched but have that size, so electrodes of an unexpected outline
+    are not lost. Without recording shapes the most common size on the
+    electrode layer is taken whatever its outline, as before shapes were
+    classified, so an array of square electrodes is not read as stimulus
+    electrodes. Every other class keeps its most common size among its
+    remaining shapes or, if its rule has 'keep', the most common size that
+    passes those checks against the recording electrodes, and is dropped when
+    none does.
+    '''
+    boxes = shapes['boxes']
+    keys = _size_keys(boxes, tol)
+    recording = CLASSES.index(RECORDING)
+    on_layer = shapes['layer'] == electrode_layer
+    candidates = codes == recording
+    if candidates.any():
+        pool = candidates | ((codes == UNCLASSIFIED) & on_layer)
+    else:
+        candidates = pool = on_layer
+    taken = np.zeros(len(boxes), dtype=bool)
+    selected = {}
+    if candidates.any():
+        candidates = np.flatnonzero(candidates)
+        size = keys[candidates[size_groups(boxes[candidates], tol)[0][0]]]
+        taken = pool & (keys == size).all(axis=1)
+        selected[recording] = boxes[taken]
+
+    array = None
+    for name, rule in rules:
+        code = CLASSES.index(name)
+        mine = boxes[(codes == code) & ~taken]
+        if code == recording or len(mine) == 0:
+            continue
+        keep = rule.get('keep')
+        if keep is not None and array is None and recording in selected:
+            array = _recording_array(selected[recording])
+        for group in size_groups(mine, tol):
+            if keep is None or _fits(mine[group], keep, array):
+                selected[code] = mine[group]
+                break
+    return dict(sorted(selected.items()))
@@ -1,254 +1,158 @@
-import gdspy
-import pandas as pd
 import numpy as np
 import sys
 from pathlib import Path
-import yaml
-
-# --- paste your two mapping arrays here (from the .pages) ---
-OLD_MAPPING = [
-[178,  79, 177,  80, 208,  49, 207,  50],
-[179,  78,  77, 180,  52, 205, 206,  51],
-[181,  76,  75, 182,  54, 203, 204,  53],
-[183,  74,  73, 184,  56, 201, 202,  55],
-[185,  72,  71, 186,  58, 199, 200,  57],
-[187,  70,  69, 188,  60, 197, 198,  59],
-[189,  68,  67, 190,  62, 195, 194,  61],
-[191,  66,  65, 192,  64, 255, 196,  63],
-[129, 128, 127, 130,   2, 193, 256,   1],
-[131, 126, 125, 132,   4, 253, 252,   3],
-[133, 124, 123, 134,   6, 249, 254,   5],
-[135, 122, 121, 136,   8, 251, 250,   7],
-[137, 120, 119, 138,  10, 247, 246,   9],
-[139, 118, 117, 140,  12, 243, 248,  11],
-[141, 116, 115, 142,  14, 245, 244,  13],
-[143, 114, 113, 144,  16, 241, 242,  15],
-[145, 112, 111, 146,  18, 239, 240,  17],
-[147, 110, 109, 148,  20, 237, 238,  19],
-[149, 108, 107, 150,  22, 235, 236,  21],
-[151, 106, 105, 152,  24, 233, 234,  23],
-[153, 104, 103, 154,  26, 231, 232,  25],
-[155, 102, 101, 156,  28, 229, 230,  27],
-[157, 100,  99, 158,  30, 227, 228,  29],
-[159,  98,  97, 160,  32, 225, 226,  31],
-[161,  96,  95, 162,  34, 223, 224,  33],
-[163,  94,  93, 164,  36, 221, 222,  35],
-[165,  92,  91, 166,  38, 219, 220,  37],
-[167,  90,  89, 168,  40, 217, 218,  39],
-[169,  88,  87, 170,  42, 215, 216,  41],
-[171,  86,  85, 172,  44, 213, 214,  43],
-[173,  84,  83, 174,  46, 211, 212,  45],
-[175,  82,  81, 176,  48, 209, 210,  47],
-[466, 304, 303, 467, 339, 431, 432, 338],
-[300, 469, 470, 465, 337, 342, 341, 428],
-[302, 473, 465, 301, 429, 340, 345, 430],
-[298, 471, 472, 297, 425, 344, 343, 426],
-[294, 475, 476, 299, 427, 248, 247, 422],
-[296, 479, 474, 295, 423, 346, 351, 424],
-[292, 477, 478, 291, 419, 350, 349, 420],
-[288, 482, 482, 293, 421, 354, 353, 416],
-[290, 485, 480, 289, 417, 352, 357, 418],
-[286, 483, 484, 285, 413, 356, 355, 414],
-[282, 487, 488, 287, 415, 360, 259, 410],
-[284, 491, 480, 283, 411, 358, 363, 412],
-[280, 489, 490, 279, 407, 362, 361, 408],
-[276, 493, 494, 281, 409, 366, 365, 404],
-[278, 273, 492, 277, 405, 364, 401, 406],
-[495, 275, 274, 496, 368, 402, 403, 367],
-[498, 272, 271, 499, 371, 399, 400, 370],
-[268, 501, 502, 497, 369, 374, 373, 398],
-[270, 505, 500, 269, 397, 372, 377, 396],
-[266, 503, 504, 265, 395, 376, 375, 394],
-[262, 507, 508, 267, 393, 380, 379, 392],
-[264, 511, 506, 263, 391, 378, 383, 390],
-[260, 509, 510, 259, 389, 382, 381, 388],
-[320, 449, 450, 261, 387, 322, 321, 386],
-[258, 453, 512, 257, 385, 384, 325, 448],
-[318, 451, 452, 317, 447, 324, 323, 446],
-[314, 455, 456, 319, 445, 328, 327, 442],
-[316, 459, 454, 315, 443, 326, 331, 444],
-[312, 457, 458, 311, 439, 330, 329, 440],
-[308, 461, 462, 313, 441, 334, 333, 436],
-[310, 305, 460, 309, 437, 332, 433, 438],
-[464, 306, 463, 307, 435, 335, 434, 336]
-]
-
-NEW_MAPPING = [
-[ 49,  17,  48,  16,  79, 304,  78, 305],
-[ 50,  18,  19,  51, 307,  76,  77, 306],
-[ 52,  20,  21,  53, 309,  74,  75, 308],
-[ 54,  22,  23,  55, 311,  72,  73, 310],
-[ 56,  24,  25,  57, 313,  70,  71, 312],
-[ 58,  26,  27,  59, 315,  68,  69, 314],
-[ 60,  28,  29,  61, 317,  66,  65, 316],
-[ 62,  30,  31,  63, 319, 126,  67, 318],
-[  0,  32,  33,   1, 257,  64, 127, 256],
-[  2,  34,  35,   3, 259, 124, 123, 258],
-[  4,  36,  37,   5, 261, 120, 125, 260],
-[  6,  38,  39,   7, 263, 122, 121, 262],
-[  8,  40,  41,   9, 265, 118, 117, 264],
-[ 10,  42,  43,  11, 267, 114, 119, 266],
-[ 12,  44,  45,  13, 269, 116, 115, 268],
-[ 14,  46,  47,  15, 271, 112, 113, 270],
-[399, 398, 396, 397, 296, 110, 111, 297],
-[395, 394, 392, 393, 294, 108, 109, 295],
-[391, 390, 388, 389, 292, 106, 107, 293],
-[387, 386, 384, 385, 290, 104, 105, 291],
-[447, 446, 444, 445, 288, 102, 103, 289],
-[443, 442, 440, 441, 286, 100, 101, 287],
-[439, 438, 436, 437, 284,  98,  99, 285],
-[435, 434, 432, 433, 282,  96,  97, 283],
-[431, 430, 428, 429, 280,  94,  95, 281],
-[427, 426, 424, 425, 278,  92,  93, 279],
-[423, 422, 420, 421, 276,  90,  91, 277],
-[419, 418, 416, 417, 274,  88,  89, 275],
-[415, 414, 412, 413, 272,  86,  87, 273],
-[411, 410, 408, 409, 302,  84,  85, 303],
-[407, 406, 404, 405, 300,  82,  83, 301],
-[403, 402, 400, 401, 298,  80,  81, 299],
-[493, 494, 492, 491, 338, 174, 175, 337],
-[486, 487, 485, 495, 336, 341, 340, 171],
-[490, 479, 495, 488, 172, 339, 344, 173],
-[482, 483, 481, 480, 168, 343, 342, 169],
-[474, 475, 473, 484, 170, 119, 118, 165],
-[478, 467, 477, 476, 166, 345, 350, 167],
-[470, 471, 469, 468, 162, 349, 348, 163],
-[462, 461, 461, 472, 164, 353, 352, 159],
-[466, 455, 465, 464, 160, 351, 356, 161],
-[458, 459, 457, 456, 156, 355, 354, 157],
-[450, 451, 449, 460, 158, 359, 221, 153],
-[454, 507, 465, 452, 154, 357, 362, 155],
-[510, 511, 509, 508, 150, 361, 360, 151],
-[502, 503, 501, 448, 152, 365, 364, 147],
-[506, 496, 505, 504, 148, 363, 144, 149],
-[499, 500, 498, 497, 367, 145, 146, 366],
-[241, 208, 209, 242, 370, 142, 143, 369],
-[212, 244, 245, 240, 368, 373, 372, 141],
-[210, 248, 243, 211, 140, 371, 376, 139],
-[214, 246, 247, 215, 138, 375, 374, 137],
-[218, 250, 251, 213, 136, 379, 378, 135],
-[216, 254, 249, 217, 134, 377, 382, 133],
-[220, 252, 253, 221, 132, 381, 380, 131],
-[224, 192, 193, 219, 130, 321, 320, 129],
-[222, 196, 255, 223, 128, 383, 324, 191],
-[226, 194, 195, 227, 190, 323, 322, 189],
-[230, 198, 199, 225, 188, 327, 326, 185],
-[228, 202, 197, 229, 186, 325, 330, 187],
-[232, 200, 201, 233, 182, 329, 328, 183],
-[236, 204, 205, 231, 184, 333, 332, 179],
-[234, 239, 203, 235, 180, 331, 176, 181],
-[207, 238, 206, 237, 178, 334, 177, 335]
-]
-
-# --- end pasted arrays ---
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from lattice import infer_lattice
+from map_registry import MapRegistry, load_probe_positions
+
+# pandas, gdspy and yaml are imported inside the functions that need them, so
+# importing this module for fill_missing_positions_compact stays cheap
+
+# OLD/NEW channel maps live in eval_mea/maps as <pair>_old.csv / <pair>_new.csv
+MAPS = MapRegistry(Path(__file__).resolve().parent / 'maps')
+DEFAULT_PAIR = 'long_mea_6x'
+
+
+def __getattr__(name):
+    # OLD_MAPPING / NEW_MAPPING used to be pasted literals; load them on first access instead
+    if name == 'OLD_MAPPING':
+        return MAPS[f'{DEFAULT_PAIR}_old']
+    if name == 'NEW_MAPPING':
+        return MAPS[f'{DEFAULT_PAIR}_new']
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
 
 CSV_PATH = Path("eval_mea/mea_map.csv")
+REPORT_PATH = Path("eval_mea/mapping_report.csv")
 
-def compare_mappings():
-    if not CSV_PATH.exists():
-        print(f"CSV not found at {CSV_PATH.resolve()}. Please place 'mea_map.csv' at this path.", file=sys.stderr)
-        sys.exit(2)
+REPORT_COLUMNS = ['pair', 'check', 'row', 'col', 'old', 'expected_new', 'actual_new', 'value', 'count']
 
-    df = pd.read_csv(CSV_PATH, dtype={'old': int, 'new': int})
+
+def load_csv_mapping(csv_path=CSV_PATH):
+    """
+    Read an old -> new channel CSV and return (old, new) int arrays.
+    """
+    import pandas as pd
+
+    df = pd.read_csv(csv_path, dtype={'old': int, 'new': int})
     if 'old' not in df.columns or 'new' not in df.columns:
         raise ValueError("CSV must have 'old' and 'new' columns")
+    return df['old'].to_numpy(), df['new'].to_numpy()
+
+
+def build_lookup(csv_old, csv_new):
+    """
+    Dense lookup array: lookup[old] = expected new, -1 where the CSV has no entry.
+    For duplicate 'old' entries the last one wins, as with a dict. Negative
+    'old' channels are rejected, as they would index the lookup from its end.
+    """
+    if csv_old.size and csv_old.min() < 0:
+        raise ValueError(f"CSV 'old' channels must be non-negative, found {int(csv_old.min())}")
+    lookup = np.full(int(csv_old.max()) + 1 if csv_old.size else 0, -1, dtype=np.int64)
+    lookup[csv_old] = csv_new
+    return lookup
+
+
+def _duplicates(values):
+    uniques, counts = np.unique(values, return_counts=True)
+    return uniques[counts > 1], counts[counts > 1]
+
+
+def validate_mapping(old_map, new_map, csv_old, lookup, name='default'):
+    """
+    Check one OLD/NEW grid pair against a CSV lookup in a single vectorised pass.
+    Returns (summary dict, report DataFrame with REPORT_COLUMNS).
+    Grids of different shape are compared over their common top-left block.
+    """
+    import pandas as pd
+
+    old_map, new_map = np.asarray(old_map, dtype=np.int64), np.asarray(new_map, dtype=np.int64)
+    if old_map.shape != new_map.shape:
+        print(f"Warning [{name}]: OLD and NEW shapes differ ({old_map.shape} vs {new_map.shape}). "
+              "Comparing the common block.")
+    rows, cols = (min(a, b) for a, b in zip(old_map.shape, new_map.shape))
+    old_map, new_map = old_map[:rows, :cols], new_map[:rows, :cols]
+
+    in_range = (old_map >= 0) & (old_map < lookup.size)
+    expected = np.where(in_range, lookup[np.clip(old_map, 0, max(lookup.size - 1, 0))], -1)
+    missing = expected < 0
+    mismatch = ~missing & (expected != new_map)
+    unused_csv_old = np.setdiff1d(csv_old, old_map)
+
+    frames = []
+    for check, mask in (('mismatch', mismatch), ('missing_old', missing)):
+        r, c = np.nonzero(mask)
+        frames.append(pd.DataFrame({'check': check, 'row': r, 'col': c, 'old': old_map[r, c],
+                                    'expected_new': np.where(missing[r, c], np.nan, expected[r, c]),
+                                    'actual_new': new_map[r, c]}))
+    frames.append(pd.DataFrame({'check': 'unused_csv_old', 'value': unused_csv_old}))
+    duplicates = {}
+    for check, values in (('duplicate_old', old_map), ('duplicate_new', new_map), ('duplicate_csv_old', csv_old)):
+        dup_values, dup_counts = _duplicates(values)
+        duplicates[check] = dup_values.size
+        frames.append(pd.DataFrame({'check': check, 'value': dup_values, 'count': dup_counts}))
+
+    frames = [f for f in frames if len(f)]
+    report = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=REPORT_COLUMNS)
+    report = report.reindex(columns=REPORT_COLUMNS).assign(pair=name)
+    report = report.astype({c: 'Int64' for c in REPORT_COLUMNS[2:]})
+    summary = {'pair': name, 'positions': old_map.size, 'mismatches': int(mismatch.sum()),
+               'missing_old': int(missing.sum()), 'unused_csv_old': unused_csv_old.size, **duplicates}
+    return summary, report
+
+
+def compare_mappings(pairs=None, report_path=REPORT_PATH):
+    """
+    Validate any number of map pairs and write one consolidated report.
+    pairs maps a name to (old_map, new_map) or (old_map, new_map, csv_path);
+    the default is every OLD/NEW pair in MAPS against CSV_PATH.
+    Exits with status 1 if any pair has mismatches and with status 2 if there
+    is nothing to compare.
+    """
+    import pandas as pd
+
+    where = ''
+    if pairs is None:
+        pairs = MAPS.pairs()
+        where = f" (looked for <pair>_old / <pair>_new files in {MAPS.directory})"
+    if not pairs:
+        print(f"No map pairs to compare{where}.", file=sys.stderr)
+        sys.exit(2)
 
-    # Build mapping from CSV: old_value -> expected_new_value
-    mapping = df.set_index('old')['new'].to_dict()
-
-    # detect duplicates in CSV (same old mapping to multiple new)
-    dup_old = df['old'][df['old'].duplicated(keep=False)]
-    if not dup_old.empty:
-        print("Warning: duplicate 'old' entries in CSV for these 'old' values:", dup_old.unique())
-
-    mismatches = []
-    missing_old_entries = []
-    total_positions = 0
-
-    # Check shapes match
-    if len(OLD_MAPPING) != len(NEW_MAPPING) or any(len(a)!=len(b) for a,b in zip(OLD_MAPPING, NEW_MAPPING)):
-        print("Warning: OLD_MAPPING and NEW_MAPPING shapes differ. We'll compare up to the min shape in each row.")
-
-    # iterate row/col positions
-    nrows = min(len(OLD_MAPPING), len(NEW_MAPPING))
-    for r in range(nrows):
-        row_old = OLD_MAPPING[r]
-        row_new = NEW_MAPPING[r]
-        ncols = min(len(row_old), len(row_new))
-        for c in range(ncols):
-            total_positions += 1
-            old_val = int(row_old[c])
-            actual_new = int(row_new[c])
-            if old_val not in mapping:
-                missing_old_entries.append({'row': r, 'col': c, 'old': old_val, 'actual_new': actual_new})
-            else:
-                expected_new = int(mapping[old_val])
-                if expected_new != actual_new:
-                    mismatches.append({
-                        'row': r, 'col': c,
-                        'old': old_val,
-                        'expected_new': expected_new,
-                        'actual_new': actual_new
-                    })
-
-    # also detect old entries in CSV that are never used in OLD_MAPPING
-    all_old_in_arrays = set(np.array(OLD_MAPPING).flatten().tolist())
-    csv_old_set = set(df['old'].unique().tolist())
-    unused_csv_old = sorted(list(csv_old_set - all_old_in_arrays))
-    # --- check for duplicate numbers in the mappings ---
-    flat_old = np.array(OLD_MAPPING).flatten()
-    flat_new = np.array(NEW_MAPPING).flatten()
-
-    dup_old_nums = pd.Series(flat_old)[pd.Series(flat_old).duplicated(keep=False)]
-    dup_new_nums = pd.Series(flat_new)[pd.Series(flat_new).duplicated(keep=False)]
-
-    if not dup_old_nums.empty or not dup_new_nums.empty:
-        print("=== Duplicate number check ===")
-        if not dup_old_nums.empty:
-            dup_counts_old = pd.Series(flat_old).value_counts()
-            print("Duplicates in OLD_MAPPING:")
-            print(dup_counts_old[dup_counts_old > 1])
-            dup_counts_old[dup_counts_old > 1].to_csv("eval_mea/duplicate_old_numbers.csv")
-            print("Saved duplicate old numbers to eval_mea/duplicate_old_numbers.csv")
-        if not dup_new_nums.empty:
-            dup_counts_new = pd.Series(flat_new).value_counts()
-            print("\nDuplicates in NEW_MAPPING:")
-            print(dup_counts_new[dup_counts_new > 1])
-            dup_counts_new[dup_counts_new > 1].to_csv("eval_mea/duplicate_new_numbers.csv")
-            print("Saved duplicate new numbers to eval_mea/duplicate_new_numbers.csv")
-    else:
-        print("No duplicate numbers found in OLD_MAPPING or NEW_MAPPING ✅")
-
-    # report
+    lookups = {}
+    summaries, reports = [], []
+    for name, pair in pairs.items():
+        old_map, new_map, csv_path = (*pair, CSV_PATH) if len(pair) == 2 else pair
+        csv_path = Path(csv_path)
+        if csv_path not in lookups:
+            if not csv_path.exists():
+                print(f"CSV not found at {csv_path.resolve()}. Please place 'mea_map.csv' at this path.", file=sys.stderr)
+                sys.exit(2)
+            csv_old, csv_new = load_csv_mapping(csv_path)
+            lookups[csv_path] = csv_old, build_lookup(csv_old, csv_new)
+        summary, report = validate_mapping(old_map, new_map, *lookups[csv_path], name=name)
+        summaries.append(summary)
+        reports.append(report)
+
+    summary_df = pd.DataFrame(summaries).set_index('pair')
     print("=== Mapping check summary ===")
-    print(f"Total positions checked: {total_positions}")
-    print(f"Missing 'old' entries in CSV: {len(missing_old_entries)}")
-    print(f"Positions where CSV says a different 'new' (mismatches): {len(mismatches)}")
-    print(f"CSV 'old' values not present in OLD_MAPPING (unused in arrays): {len(unused_csv_old)}")
-
-    if mismatches:
-        mismatches_df = pd.DataFrame(mismatches)
-        mismatches_df.to_csv("eval_mea/mismatches.csv", index=False)
-        print(f"Saved {len(mismatches)} mismatches to eval_mea/mismatches.csv (columns: row,col,old,expected_new,actual_new)")
-    else:
-        print("No mismatches found ✅")
-
-    if missing_old_entries:
-        missing_df = pd.DataFrame(missing_old_entries)
-        missing_df.to_csv("eval_mea/missing_old_entries.csv", index=False)
-        print(f"Saved {len(missing_old_entries)} missing-old entries to eval_mea/missing_old_entries.csv (these olds are not in the CSV).")
+    print(summary_df.to_string())
 
-    if unused_csv_old:
-        pd.DataFrame({'unused_csv_old': unused_csv_old}).to_csv("eval_mea/unused_csv_old.csv", index=False)
-        print(unused_csv_old)
-        print(f"Saved {len(unused_csv_old)} CSV-old values that never appear in OLD_MAPPING to unused_csv_old.csv")
+    report = pd.concat(reports, ignore_index=True) if reports else pd.DataFrame(columns=REPORT_COLUMNS)
+    if len(report):
+        report.to_csv(report_path, index=False)
+        print(f"Saved {len(report)} findings to {report_path} (columns: {','.join(REPORT_COLUMNS)})")
+    else:
+        print("No mismatches, missing entries, unused CSV entries or duplicates found ✅")
 
     # Fail (non-zero exit) if mismatches found (optional):
-    if mismatches:
-        print("\nERROR: Found mismatches. Inspect mismatches.csv for details.", file=sys.stderr)
+    if summary_df['mismatches'].any():
+        print(f"\nERROR: Found mismatches. Inspect {report_path} for details.", file=sys.stderr)
         sys.exit(1)
 
     print("\nAll checked positions matched the CSV mapping (except missing entries).")
+    return summary_df, report
 
     
 # print(comparing_db.head())
@@ -258,74 +162,48 @@ ELECTRODE_DIAMETER = 30  # in micrometers
 # writing electrode positions to gds file 
 
 def draw_electrodes(MEA, electrode_positions):
+    import gdspy
+
     for pos in electrode_positions:
         dot = gdspy.Round(pos, radius=ELECTRODE_DIAMETER / 2,
                         inner_radius=0, number_of_points=60, layer=2)
         MEA.add(dot)
 
-def get_positions_from_yaml(yaml_file):
-    with open(yaml_file, 'r') as f:
-        data = yaml.safe_load(f)
-
-    # Extract positions
-    pos = data.get("pos", [])
-
-    # Filter out invalid/null positions
-    positions = [
-        tuple(p) for p in pos
-        if p is not None and len(p) == 2 and None not in p
-    ]
-
-    return positions
-
-import numpy as np
-
-def fill_missing_positions_compact(known, pitch=None, tol=1e-6):
-    """Infer a rectangular grid and fill missing (x,y) points."""
-    pts = [(float(p[0]), float(p[1])) for p in known if p and None not in p]
-    if not pts:
-        return [], []
-
-    arr = np.unique(np.array(pts), axis=0)
-    xs, ys = np.unique(arr[:,0]), np.unique(arr[:,1])
-
-    def infer(d):
-        if len(d) < 2:
-            return 0.0
-        diffs = np.diff(np.sort(d))
-        diffs = diffs[diffs > tol]
-        return float(np.round(np.median(diffs))) if diffs.size else 0.0
-
-    if pitch is None:
-        px, py = infer(xs), infer(ys)
-        if px <= tol: px = float(xs[1]-xs[0]) if xs.size>1 else 1.0
-        if py <= tol: py = float(ys[1]-ys[0]) if ys.size>1 else 1.0
+def get_positions_from_yaml(yaml_file, sidecars=True):
+    """
+    Contact positions of a probe file as an (N, 2) float array and an (N,)
+    validity mask; null entries are NaN rows, so positions[valid] are the
+    usable contacts. Parsed files are cached as binary sidecars in
+    <dir>/.map_cache and only re-parsed when the YAML changes.
+    """
+    return load_probe_positions(yaml_file, sidecars=sidecars)
+
+def fill_missing_positions_compact(known, pitch=None, tol=1e-6, kind='rect'):
+    """
+    Infer the electrode lattice of the known (x, y) points and return every
+    lattice site, known and filled, as a list of (x, y) sorted by x then y.
+    Invalid entries (None or NaN) are ignored. See lattice.infer_lattice for
+    the array form, which also returns the missing-site mask.
+    """
+    if isinstance(known, np.ndarray):
+        points = known.astype(float).reshape(-1, 2)
     else:
-        px, py = float(pitch[0]), float(pitch[1])
-
-    def make_coords(vals, step):
-        vmin, vmax = float(vals.min()), float(vals.max())
-        n = int(round((vmax - vmin) / step)) if step>tol else 0
-        if n==0: return np.array([vmin])
-        coords = vmin + np.arange(n+1) * step
-        if coords[-1] + tol < vmax:
-            coords = np.append(coords, coords[-1] + step)
-        return coords
-
-    gx, gy = make_coords(arr[:,0], px), make_coords(arr[:,1], py)
-    grid = {(float(x), float(y)) for x in gx for y in gy}
-
-    filled = sorted(list(grid))
-
-    return filled
+        points = np.array([p if p is not None else (np.nan, np.nan) for p in known], dtype=float).reshape(-1, 2)
+    if not np.isfinite(points).all(axis=1).any():
+        return []
+    sites = infer_lattice(points, kind=kind, pitch=pitch, tol=tol).sites
+    sites = sites[np.lexsort((sites[:, 1], sites[:, 0]))]
+    return [tuple(p) for p in sites.tolist()]
 
 
 if __name__ == "__main__":
+    import gdspy
+
     compare_mappings()
     MEA_lib = gdspy.GdsLibrary()
     MEA_cell = gdspy.Cell('MEA_with_Electrodes')
-    electrode_positions = get_positions_from_yaml('eval_mea/512_long_mea_6x.yaml')
-    filled_electrode_positions= fill_missing_positions_compact(electrode_positions)
+    electrode_positions, valid = get_positions_from_yaml('eval_mea/512_long_mea_6x.yaml')
+    filled_electrode_positions= fill_missing_positions_compact(electrode_positions[valid])
     draw_electrodes(MEA_cell, filled_electrode_positions)
     MEA_lib.add(MEA_cell)
     MEA_lib.write_gds('eval_mea/MEA_with_electrodes.gds')
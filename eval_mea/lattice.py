@@ -0,0 +1,188 @@
+from dataclasses import dataclass
+
+import numpy as np
+
+# refuse lattices with far more sites than known points, a sign the pitch inference failed
+MAX_FILL_RATIO = 100
+# sorted coordinate gaps jumping by more than this factor separate noise within a row/column
+# from the spacing between rows/columns
+LEVEL_GAP_RATIO = 3.0
+
+
+@dataclass
+class Lattice:
+    '''
+    A rectangular or hexagonal electrode lattice inferred from known points.
+    sites: (M, 2) coordinates of every lattice site, row by row (row = constant y).
+    known_index: (N,) index into sites of every known point, in input order.
+    missing: (M,) True for sites with no known point.
+    In a hexagonal lattice odd rows are shifted by pitch[0] / 2.
+    '''
+    kind: str
+    pitch: tuple
+    origin: tuple
+    shape: tuple  # (rows, columns)
+    sites: np.ndarray
+    known_index: np.ndarray
+    missing: np.ndarray
+
+
+def _levels(values, min_gap):
+    '''
+    Cluster 1D positions: sorted values closer than min_gap are one level.
+    Returns the mean position of every level.
+    '''
+    values = np.sort(values)
+    labels = np.concatenate(([0], np.cumsum(np.diff(values) > min_gap)))
+    return np.bincount(labels, weights=values) / np.bincount(labels)
+
+
+def _level_gap(values, tol):
+    '''
+    Spacing between the levels (rows or columns) of 1D positions, from their
+    sorted gaps. Returns (spacing, separated): with separated, spacing is the
+    first gap above the largest jump of more than LEVEL_GAP_RATIO into the
+    upper half of the gaps (the gaps below are noise within a level), or 0.0
+    for a single level without noise. Without such a jump every gap is either
+    noise or a spacing, and spacing is their median.
+    '''
+    gaps = np.maximum(np.sort(np.diff(np.sort(values))), tol)
+    if gaps.size == 0 or gaps[-1] <= tol:
+        return 0.0, True
+    ratios = gaps[1:] / gaps[:-1]
+    jumps = np.flatnonzero((ratios > LEVEL_GAP_RATIO) & (gaps[1:] >= np.median(gaps)))
+    if jumps.size:
+        return float(gaps[jumps[np.argmax(ratios[jumps])] + 1]), True
+    return float(np.median(gaps)), False
+
+
+def _min_gap(points, tol):
+    '''
+    Half the smallest row/column spacing: positions closer than that are the
+    same row/column. An axis without a clear jump between noise and spacing
+    only counts when its median gap is comparable to the other axis' spacing;
+    otherwise (a single noisy row or column) it is all noise.
+    '''
+    levels = [_level_gap(points[:, axis], tol) for axis in (0, 1)]
+    separated = [spacing for spacing, clear in levels if clear and spacing > 0]
+    unclear = [spacing for spacing, clear in levels if not clear]
+    if separated:
+        spacing = min(separated)
+        spacing = min([spacing] + [s for s in unclear if s * LEVEL_GAP_RATIO >= spacing])
+    else:
+        spacing = max(unclear, default=0.0)
+    return max(spacing / 2, tol)
+
+
+def _axis_pitch(values, min_gap):
+    '''
+    Pitch of 1D positions with noise below min_gap and possibly missing levels.
+    '''
+    levels = _levels(values, min_gap)
+    if len(levels) < 2:
+        return 0.0
+    return _refine_pitch(levels, float(np.min(np.diff(levels))))
+
+
+def _refine_pitch(values, pitch):
+    '''
+    Pitch from sorted 1D positions: every gap is divided by the number of
+    pitches it spans, so gaps left by missing electrodes still count, and the
+    pitch is the least-squares slope of the positions over their step count.
+    '''
+    steps = np.concatenate(([0.0], np.cumsum(np.round(np.diff(values) / pitch))))
+    if steps[-1] < 1:
+        return pitch
+    return float(np.polyfit(steps, values, 1)[0])
+
+
+def _origin(values, pitch):
+    '''
+    Lattice offset of 1D positions: the minimum shifted by the median residual.
+    '''
+    start = values.min()
+    residual = (values - start + pitch / 2) % pitch - pitch / 2
+    return float(start + np.median(residual))
+
+
+def _row_pitch(points, rows, min_gap):
+    '''
+    Distance between neighbours within the same row, a first guess for
+    _refine_pitch: the smallest gap, refined to the median gap per pitch it
+    spans so coordinate noise does not shrink it.
+    '''
+    order = np.lexsort((points[:, 0], rows))
+    same_row = rows[order][1:] == rows[order][:-1]
+    gaps = np.diff(points[order, 0])[same_row]
+    gaps = gaps[gaps > min_gap]
+    if not gaps.size:
+        return 0.0
+    steps = np.round(gaps / gaps.min())
+    return float(np.median(gaps / steps))
+
+
+def _is_hexagonal(points, rows, px, tol):
+    '''
+    True when odd rows sit half a pitch off the even rows.
+    '''
+    parity = rows % 2
+    if px <= tol or parity.all() or not parity.any():
+        return False
+    phase = points[:, 0] % px
+    shift = (np.median(phase[parity == 1]) - np.median(phase[parity == 0])) % px
+    return abs(shift - px / 2) < px / 4
+
+
+def infer_lattice(known, kind='auto', pitch=None, tol=1e-6):
+    '''
+    Infer the lattice spanned by the known points and mark the missing sites.
+    kind = 'auto' | 'rect' | 'hex'. pitch = (column pitch, row pitch) skips the
+    pitch inference. Rows are taken along y. Coordinates may carry noise up to
+    about a tenth of the pitch.
+    '''
+    points = np.asarray(known, dtype=float).reshape(-1, 2)
+    points = points[np.isfinite(points).all(axis=1)]
+    if len(points) == 0:
+        raise ValueError('No valid positions to infer a lattice from.')
+
+    # positions closer than half the smallest row/column spacing are the same row/column
+    min_gap = _min_gap(points, tol)
+
+    # --- rows: pitch and origin along y ---
+    py = _axis_pitch(points[:, 1], min_gap) if pitch is None else float(pitch[1])
+    oy = _origin(points[:, 1], py) if py > tol else float(np.median(points[:, 1]))
+    rows = np.round((points[:, 1] - oy) / py).astype(np.int64) if py > tol else np.zeros(len(points), np.int64)
+    oy += rows.min() * py
+    rows -= rows.min()
+
+    # --- columns: pitch within a row, then the half-pitch shift of odd rows ---
+    px = _row_pitch(points, rows, min_gap) if pitch is None else float(pitch[0])
+    if kind == 'auto':
+        kind = 'hex' if _is_hexagonal(points, rows, px, tol) else 'rect'
+    if kind not in ('rect', 'hex'):
+        raise ValueError(f'Unknown lattice kind: {kind!r}')
+
+    shift = (rows % 2) * (px / 2) if kind == 'hex' else np.zeros(len(points))
+    unshifted = points[:, 0] - shift
+    if pitch is None and px > tol:
+        px = _refine_pitch(_levels(unshifted, min_gap), px)
+    ox = _origin(unshifted, px) if px > tol else float(np.median(unshifted))
+    cols = np.round((unshifted - ox) / px).astype(np.int64) if px > tol else np.zeros(len(points), np.int64)
+    ox += cols.min() * px
+    cols -= cols.min()
+
+    # --- build the lattice and index the known points into it ---
+    n_rows, n_cols = int(rows.max()) + 1, int(cols.max()) + 1
+    if n_rows * n_cols > MAX_FILL_RATIO * len(points):
+        raise ValueError(f'Inferred a {n_rows}x{n_cols} lattice for {len(points)} points; '
+                         f'pass pitch explicitly (inferred pitch {px}, {py}).')
+    grid_cols, grid_rows = np.meshgrid(np.arange(n_cols), np.arange(n_rows))
+    grid_cols, grid_rows = grid_cols.ravel(), grid_rows.ravel()
+    grid_shift = (grid_rows % 2) * (px / 2) if kind == 'hex' else 0.0
+    sites = np.column_stack((ox + grid_cols * px + grid_shift, oy + grid_rows * py))
+
+    known_index = rows * n_cols + cols
+    missing = np.ones(len(sites), dtype=bool)
+    missing[known_index] = False
+    return Lattice(kind=kind, pitch=(px, py), origin=(ox, oy), shape=(n_rows, n_cols),
+                   sites=sites, known_index=known_index, missing=missing)
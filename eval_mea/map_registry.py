@@ -0,0 +1,162 @@
+import os
+import zipfile
+from pathlib import Path
+
+import numpy as np
+
+from cache import file_digest
+
+MAP_SUFFIXES = ('.csv', '.yaml', '.yml', '.npy')
+SIDECAR_DIR = '.map_cache'
+
+
+def _load_csv(path):
+    # headerless integer grid, one row per line
+    return np.loadtxt(path, delimiter=',', dtype=np.int64, ndmin=2)
+
+
+def _load_yaml(path):
+    # probe file: 'pos' as a list of [x, y] pairs, null or malformed entries become NaN
+    import yaml
+
+    # the libyaml loader is several times faster than the pure-Python one when it is built
+    loader = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+    with open(path, 'r') as f:
+        data = yaml.load(f, Loader=loader) or {}
+    pos = [p if isinstance(p, list) and len(p) == 2 else [None, None] for p in data.get('pos') or []]
+    return np.array(pos, dtype=float).reshape(-1, 2)
+
+
+_LOADERS = {'.csv': _load_csv, '.yaml': _load_yaml, '.yml': _load_yaml, '.npy': np.load}
+
+
+def _sidecar_path(path):
+    return path.parent / SIDECAR_DIR / f'{path.name}.npz'
+
+
+def _read_sidecar(path, sidecar):
+    '''
+    Cached array of path, or None when the sidecar is missing, stale or corrupt
+    (a corrupt one is removed). A sidecar is fresh when the source size and
+    mtime match; after a touch or checkout that only changed the mtime, a
+    matching content hash also counts and is recorded.
+    '''
+    try:
+        st = path.stat()
+        with np.load(sidecar) as cached:
+            array = cached['array']
+            size, mtime_ns, digest = int(cached['size']), int(cached['mtime_ns']), str(cached['sha256'])
+    except (zipfile.BadZipFile, EOFError, ValueError, KeyError):
+        try:
+            sidecar.unlink()
+        except OSError:
+            pass
+        return None
+    except OSError:
+        return None
+    if size != st.st_size:
+        return None
+    if mtime_ns != st.st_mtime_ns:
+        if digest != file_digest(path):
+            return None
+        _write_sidecar(path, sidecar, array, digest)
+    return array
+
+
+def _write_sidecar(path, sidecar, array, digest=None):
+    try:
+        st = path.stat()
+        sidecar.parent.mkdir(exist_ok=True)
+        tmp = sidecar.with_suffix('.tmp.npz')
+        np.savez(tmp, array=array, size=st.st_size, mtime_ns=st.st_mtime_ns,
+                 sha256=digest or file_digest(path))
+        os.replace(tmp, sidecar)
+    except OSError:
+        pass  # read-only checkout, keep the in-memory copy only
+
+
+def load_map(path, sidecars=True):
+    '''
+    Parse one channel map or probe file into an array, going through its
+    <dir>/.map_cache/<file>.npz sidecar when sidecars is True.
+    '''
+    path = Path(path)
+    if not sidecars or path.suffix == '.npy':
+        return _LOADERS[path.suffix](path)
+    sidecar = _sidecar_path(path)
+    array = _read_sidecar(path, sidecar)
+    if array is None:
+        array = _LOADERS[path.suffix](path)
+        _write_sidecar(path, sidecar, array)
+    return array
+
+
+def load_probe_positions(path, sidecars=True):
+    '''
+    Contact positions of a YAML probe file as ((N, 2) float array, (N,) validity mask).
+    Entries that are null or not an [x, y] pair are NaN rows with mask False, so
+    row i is still contact i of the file.
+    '''
+    positions = load_map(path, sidecars=sidecars)
+    return positions, np.isfinite(positions).all(axis=1)
+
+
+class MapRegistry:
+    '''
+    Channel maps and probe files found in one directory, keyed by file stem.
+    Nothing is read until a map is first accessed; parsed arrays are then kept
+    in memory and written as .npz sidecars under <directory>/.map_cache, which
+    are reused while the source file is unchanged (see load_map).
+    Files named <pair>_old.* and <pair>_new.* form an OLD/NEW map pair.
+    '''
+
+    def __init__(self, directory, sidecars=True):
+        self.directory = Path(directory)
+        self.sidecars = sidecars
+        self._paths = None
+        self._arrays = {}
+
+    @property
+    def paths(self):
+        if self._paths is None:
+            self._paths = {}
+            if self.directory.is_dir():
+                for path in sorted(self.directory.iterdir()):
+                    if path.suffix in MAP_SUFFIXES and path.stem not in self._paths:
+                        self._paths[path.stem] = path
+        return self._paths
+
+    def names(self):
+        return list(self.paths)
+
+    def __contains__(self, name):
+        return name in self.paths
+
+    def __iter__(self):
+        return iter(self.paths)
+
+    def __len__(self):
+        return len(self.paths)
+
+    def __getitem__(self, name):
+        if name not in self._arrays:
+            self._arrays[name] = load_map(self.paths[name], sidecars=self.sidecars)
+        return self._arrays[name]
+
+    def get(self, name, default=None):
+        return self[name] if name in self else default
+
+    def pairs(self):
+        '''
+        {pair_name: (old_map, new_map)} for every <pair>_old / <pair>_new file pair.
+        '''
+        return {name[:-len('_old')]: (self[name], self[name[:-len('_old')] + '_new'])
+                for name in self.paths
+                if name.endswith('_old') and name[:-len('_old')] + '_new' in self.paths}
+
+    def clear(self):
+        '''
+        Forget the in-memory arrays and rediscover the files on next access.
+        '''
+        self._arrays.clear()
+        self._paths = None
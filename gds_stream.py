@@ -0,0 +1,525 @@
+import mmap
+import os
+import struct
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from spatial import _expand_ranges
+
+# GDSII record types used by the reader
+UNITS = 0x03
+ENDLIB = 0x04
+STRNAME = 0x06
+ENDSTR = 0x07
+BOUNDARY = 0x08
+SREF = 0x0A
+AREF = 0x0B
+LAYER = 0x0D
+XY = 0x10
+ENDEL = 0x11
+SNAME = 0x12
+COLROW = 0x13
+STRANS = 0x1A
+MAG = 0x1B
+ANGLE = 0x1C
+BOX = 0x2D
+
+# STRANS flag: mirror about the x axis before rotating
+REFLECTION = 0x8000
+
+# per-element arrays returned by read_shapes
+SHAPE_FIELDS = ('boxes', 'layer', 'vertices', 'area', 'fill')
+
+# read_shapes(..., workers=N) gives every worker at least this many bytes of the file
+SHARD_MIN_BYTES = 8 * 2**20
+
+# a BOUNDARY/BOX header followed by the LAYER, ELFLAGS or PLEX record that must come next:
+# where a shard starts its scan
+_ELEMENT_HEADERS = (b'\x00\x04\x08\x00', b'\x00\x04\x2d\x00')
+_ELEMENT_NEXT = (b'\x00\x06\x0d\x02', b'\x00\x06\x26\x01', b'\x00\x08\x2f\x03')
+
+_HEADER = struct.Struct('>HBB')
+
+
+def _eight_byte_real(data):
+    '''
+    Convert GDSII 8-byte reals (excess-64, base-16) to floats.
+    '''
+    raw = np.frombuffer(data, dtype='>u8')
+    sign = np.where(raw >> np.uint64(63), -1.0, 1.0)
+    exponent = ((raw >> np.uint64(56)) & np.uint64(0x7F)).astype(np.int64) - 64
+    mantissa = (raw & np.uint64(0x00FFFFFFFFFFFFFF)).astype(float) / 72057594037927936.0
+    return sign * mantissa * 16.0 ** exponent
+
+
+class _Reference:
+    '''
+    One SREF/AREF: the referenced cell, its STRANS/MAG/ANGLE and, for arrays,
+    the column/row counts and the three XY points.
+    '''
+    __slots__ = ('name', 'flags', 'mag', 'angle', 'columns', 'rows', 'xy')
+
+    def __init__(self):
+        self.name = None
+        self.flags = 0
+        self.mag = 1.0
+        self.angle = 0.0
+        self.columns = self.rows = 1
+        self.xy = None
+
+    def transform_key(self):
+        return self.name, bool(self.flags & REFLECTION), self.mag, self.angle
+
+
+def _reachable(root, references, names):
+    '''
+    Names of the cells root instantiates, directly or not, and whether all of
+    them have been read already.
+    '''
+    seen, stack = set(), [root]
+    complete = True
+    while stack:
+        name = stack.pop()
+        if name in seen:
+            continue
+        seen.add(name)
+        if name not in names:
+            complete = False
+            continue
+        stack.extend(ref.name for ref in references[name])
+    return seen, complete
+
+
+def _transform_boxes(boxes, reflect, mag, angle):
+    '''
+    Bounding boxes of (N, 2, 2) boxes after mirroring about x, scaling and
+    rotating about the origin. Exact for multiples of 90 degrees; for other
+    angles the rotated box is bounded, which keeps the centre of symmetric shapes.
+    '''
+    corners = np.stack((boxes[:, 0], boxes[:, 1],
+                        np.stack((boxes[:, 0, 0], boxes[:, 1, 1]), axis=1),
+                        np.stack((boxes[:, 1, 0], boxes[:, 0, 1]), axis=1)), axis=1)
+    if reflect:
+        corners = corners * np.array([1.0, -1.0])
+    theta = np.deg2rad(angle)
+    quarter = angle / 90.0
+    if quarter == round(quarter):
+        # exact sines and cosines for the common right-angle rotations
+        c, s = [(1, 0), (0, 1), (-1, 0), (0, -1)][int(round(quarter)) % 4]
+    else:
+        c, s = np.cos(theta), np.sin(theta)
+    corners = mag * (corners @ np.array([[c, s], [-s, c]], dtype=float))
+    return np.stack((corners.min(axis=1), corners.max(axis=1)), axis=1)
+
+
+def _instance_offsets(refs):
+    '''
+    Origin of every instance of a list of references, (sum of columns * rows, 2).
+    Array element (i, j) sits at xy[0] + i * (xy[1] - xy[0]) / columns + j * (xy[2] - xy[0]) / rows.
+    '''
+    xy = np.array([ref.xy for ref in refs], dtype=float)
+    columns = np.array([ref.columns for ref in refs], dtype=np.int64)
+    rows = np.array([ref.rows for ref in refs], dtype=np.int64)
+    counts = columns * rows
+    owner = np.repeat(np.arange(len(refs)), counts)
+    k = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    i, j = k % columns[owner], k // columns[owner]
+    column_step = (xy[:, 1] - xy[:, 0]) / columns[:, None]
+    row_step = (xy[:, 2] - xy[:, 0]) / rows[:, None]
+    return xy[owner, 0] + i[:, None] * column_step[owner] + j[:, None] * row_step[owner]
+
+
+def _resolve(name, own_shapes, references, resolved, active=()):
+    '''
+    All selected-layer shapes of a cell in its own coordinates, its references
+    expanded. References sharing a cell and transform are expanded together,
+    one broadcast over all of their (array) instances.
+    '''
+    if name in resolved:
+        return resolved[name]
+    if name in active:
+        raise ValueError(f'Cell {name!r} references itself.')
+    if name not in own_shapes:
+        raise ValueError(f'Referenced cell {name!r} is not defined in the GDS file.')
+    parts = [own_shapes[name]]
+    groups = {}
+    for ref in references[name]:
+        groups.setdefault(ref.transform_key(), []).append(ref)
+    for (child, reflect, mag, angle), refs in groups.items():
+        child_shapes = _resolve(child, own_shapes, references, resolved, active + (name,))
+        if len(child_shapes['boxes']) == 0:
+            continue
+        local = _transform_boxes(child_shapes['boxes'], reflect, mag, angle)
+        offsets = _instance_offsets(refs)
+        parts.append({
+            'boxes': (offsets[:, None, None, :] + local[None]).reshape(-1, 2, 2),
+            'layer': np.tile(child_shapes['layer'], len(offsets)),
+            'vertices': np.tile(child_shapes['vertices'], len(offsets)),
+            'area': np.tile(child_shapes['area'] * mag ** 2, len(offsets)),
+            'fill': np.tile(child_shapes['fill'], len(offsets)),
+        })
+    resolved[name] = {key: np.concatenate([part[key] for part in parts]) for key in SHAPE_FIELDS}
+    return resolved[name]
+
+
+def _empty_shapes():
+    return {'boxes': np.empty((0, 2, 2)), 'layer': np.empty(0, dtype=np.int64),
+            'vertices': np.empty(0, dtype=np.int64), 'area': np.empty(0), 'fill': np.empty(0)}
+
+
+def read_layer_bounding_boxes(infile, target_layer=2, cell_match='MEA', follow_references=True):
+    '''
+    Bounding boxes of the shapes on target_layer in the first cell whose name
+    contains cell_match, see read_shapes. Returns (cell_name, (N, 2, 2) boxes).
+    '''
+    cell_name, shapes = read_shapes(infile, layers=(target_layer,), cell_match=cell_match,
+                                    follow_references=follow_references)
+    return cell_name, shapes['boxes']
+
+
+class _Scan:
+    '''
+    What one pass over the record stream found. Cells are numbered in the
+    order their STRNAME appears; in a shard (a pass starting mid-file) cell 0
+    is the cell already open where it starts, named None as only the previous
+    shards know it. For every kept element the byte offset and length of its
+    XY records are listed with the element they belong to.
+    '''
+
+    def __init__(self, start):
+        self.start = start
+        self.end = None
+        self.ended = False  # ENDLIB seen
+        self.factor = None
+        self.cell_name = None
+        self.names = [None] if start > 0 else []
+        self.references = [[]] if start > 0 else []
+        self.cell_ids = {}
+        self.last_cell = 0 if start > 0 else None  # cell open where the pass ended
+        self.seg_offsets, self.seg_lengths, self.seg_elements = [], [], []
+        self.element_cells, self.element_layers = [], []
+        # cells the MEA cell instantiates, those of them not read to their ENDSTR
+        # yet, and every cell read so far; kept up to date as records arrive
+        self.reachable, self.pending, self.finished = set(), set(), set()
+
+    def open(self, name):
+        cell = self.cell_ids.get(name)
+        if cell is None:
+            cell = self.cell_ids[name] = len(self.names)
+            self.names.append(name)
+            self.references.append([])
+        return cell
+
+    def reach(self, name):
+        '''
+        Mark name and, for cells already read, everything they instantiate as
+        reachable from the MEA cell.
+        '''
+        stack = [name]
+        while stack:
+            name = stack.pop()
+            if name in self.reachable:
+                continue
+            self.reachable.add(name)
+            if name in self.finished:
+                stack.extend(ref.name for ref in self.references[self.cell_ids[name]])
+            else:
+                self.pending.add(name)
+
+    def finish(self, name):
+        self.finished.add(name)
+        self.pending.discard(name)
+
+    def references_by_name(self):
+        return {name: self.references[cell] for name, cell in self.cell_ids.items()}
+
+    def shapes(self, mm, keep=None):
+        '''
+        Per-element arrays of the kept elements of the cells where keep (bool per
+        cell) is True, all cells by default: 'cell' plus SHAPE_FIELDS, boxes and
+        area still in database units. The XY payloads are gathered out of the
+        mapped file in one vectorised copy; records always start on even
+        offsets, so 16-bit words are the finest granularity needed.
+        '''
+        element_cells = np.asarray(self.element_cells, dtype=np.int64)
+        seg_elements = np.asarray(self.seg_elements, dtype=np.int64)
+        kept = np.ones(len(seg_elements), dtype=bool) if keep is None else keep[element_cells[seg_elements]]
+        if not kept.any():
+            return {'cell': np.empty(0, dtype=np.int64), **_empty_shapes()}
+        seg_offsets = np.asarray(self.seg_offsets, dtype=np.int64)[kept]
+        seg_lengths = np.asarray(self.seg_lengths, dtype=np.int64)[kept]
+        seg_elements = seg_elements[kept]
+        words = np.frombuffer(mm, dtype=np.uint16, count=len(mm) // 2)
+        xy = words[_expand_ranges(seg_offsets // 2, seg_lengths // 2)].view('>i4').reshape(-1, 2)
+        del words
+
+        xy = xy.astype(np.int64)
+        point_elements = np.repeat(seg_elements, seg_lengths // 8)
+        starts = np.flatnonzero(np.r_[True, point_elements[1:] != point_elements[:-1]])
+        boxes = np.stack((np.minimum.reduceat(xy, starts, axis=0),
+                          np.maximum.reduceat(xy, starts, axis=0)), axis=1)
+        # shoelace over each closed point list (GDSII repeats the first point at the end)
+        cross = xy[:-1, 0].astype(float) * xy[1:, 1] - xy[1:, 0].astype(float) * xy[:-1, 1]
+        cross = np.append(cross, 0.0)
+        cross[starts[1:] - 1] = 0.0
+        area = np.abs(np.add.reduceat(cross, starts)) / 2
+        vertices = np.diff(np.append(starts, len(xy))) - 1
+        # taken here, in the element's own frame, as a rotated reference would
+        # only widen its bounding box
+        box_area = np.prod((boxes[:, 1] - boxes[:, 0]).astype(float), axis=1)
+        fill = np.divide(area, box_area, out=np.zeros_like(area), where=box_area > 0)
+
+        element_ids = point_elements[starts]
+        return {'cell': element_cells[element_ids],
+                'boxes': boxes,
+                'layer': np.asarray(self.element_layers, dtype=np.int64)[element_ids],
+                'vertices': vertices,
+                'area': area,
+                'fill': fill}
+
+
+def _scan(mm, start=0, stop=None, layers=(2,), follow_references=True, cell_match=None):
+    '''
+    Walk the records from byte start, which must be a record boundary.
+    A whole-file pass (cell_match given) stops once the first cell whose name
+    contains cell_match and everything it references have been read; without
+    follow_references only that cell is kept. A shard pass (no cell_match)
+    keeps every cell, since cell names are only known once the shards are
+    merged, and ends at the first BOUNDARY/BOX record at or after stop.
+    '''
+    size = len(mm)
+    stop = size if stop is None else stop
+    scan = _Scan(start)
+    current = scan.last_cell
+    in_element = False
+    keep = False
+    ref = None
+    element_xy = []
+    layers = set(layers)
+
+    pos = start
+    while pos + 4 <= size:
+        length, rec_type, _ = _HEADER.unpack_from(mm, pos)
+        if length < 4:
+            raise ValueError(f'Corrupt GDSII record at byte {pos}.')
+        if pos >= stop and (rec_type == BOUNDARY or rec_type == BOX):
+            break
+        data = pos + 4
+        pos += length
+
+        if current is not None:
+            if rec_type == BOUNDARY or rec_type == BOX:
+                in_element = True
+                keep = False
+                element_xy = []
+            elif rec_type == LAYER and in_element:
+                layer = struct.unpack_from('>h', mm, data)[0]
+                keep = layer in layers
+            elif rec_type == XY and in_element:
+                element_xy.append((data, length - 4))
+            elif (rec_type == SREF or rec_type == AREF) and follow_references:
+                ref = _Reference()
+            elif ref is not None:
+                if rec_type == SNAME:
+                    ref.name = mm[data:pos].rstrip(b'\0').decode('ascii')
+                elif rec_type == STRANS:
+                    ref.flags = struct.unpack_from('>H', mm, data)[0]
+                elif rec_type == MAG:
+                    ref.mag = float(_eight_byte_real(mm[data:data + 8])[0])
+                elif rec_type == ANGLE:
+                    ref.angle = float(_eight_byte_real(mm[data:data + 8])[0])
+                elif rec_type == COLROW:
+                    ref.columns, ref.rows = struct.unpack_from('>hh', mm, data)
+                elif rec_type == XY:
+                    points = struct.unpack_from(f'>{(length - 4) // 4}i', mm, data)
+                    ref.xy = [points[0:2], points[2:4], points[4:6]] if len(points) >= 6 else [points[0:2]] * 3
+                elif rec_type == ENDEL:
+                    scan.references[current].append(ref)
+                    if scan.names[current] in scan.reachable:
+                        scan.reach(ref.name)
+                    ref = None
+            if rec_type == ENDEL:
+                if in_element and keep and element_xy:
+                    for offset, nbytes in element_xy:
+                        scan.seg_offsets.append(offset)
+                        scan.seg_lengths.append(nbytes)
+                        scan.seg_elements.append(len(scan.element_cells))
+                    scan.element_cells.append(current)
+                    scan.element_layers.append(layer)
+                in_element = False
+            elif rec_type == ENDSTR:
+                scan.finish(scan.names[current])
+                current = None
+                # stop as soon as the MEA cell and everything it references have been read
+                if scan.cell_name is not None and not scan.pending:
+                    break
+        elif rec_type == STRNAME:
+            name = mm[data:pos].rstrip(b'\0').decode('ascii')
+            if cell_match is not None and scan.cell_name is None and cell_match in name:
+                scan.cell_name = name
+            if follow_references or cell_match is None or name == scan.cell_name:
+                current = scan.open(name)
+                if name == scan.cell_name:
+                    scan.reach(name)
+        elif rec_type == UNITS:
+            scan.factor = float(_eight_byte_real(mm[data:data + 8])[0])
+        elif rec_type == ENDLIB:
+            scan.ended = True
+            break
+    scan.end = pos
+    scan.last_cell = current
+    return scan
+
+
+def _read_shard(infile, start, stop, layers, follow_references):
+    '''
+    Process-pool worker: scan one byte range of infile, mapped again here so
+    only offsets travel to the worker. Returns (scan without its XY offsets,
+    per-element shapes of every cell).
+    '''
+    with open(infile, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        scan = _scan(mm, start, stop, layers=layers, follow_references=follow_references)
+        shapes = scan.shapes(mm)
+    scan.seg_offsets = scan.seg_lengths = scan.seg_elements = None
+    scan.element_cells = scan.element_layers = None
+    return scan, shapes
+
+
+def _shard_start(mm, offset):
+    '''
+    First even offset at or after offset that looks like the start of a
+    BOUNDARY/BOX element, or len(mm). Coordinates can look like one too, so
+    the merge checks it against where the previous shard ended.
+    '''
+    size = len(mm)
+    best = size
+    for header in _ELEMENT_HEADERS:
+        pos = mm.find(header, offset)
+        while 0 <= pos < best:
+            if pos % 2 == 0 and mm[pos + 4:pos + 8] in _ELEMENT_NEXT:
+                best = pos
+                break
+            pos = mm.find(header, pos + 1)
+    return best
+
+
+def _assemble(cell_name, names, references, cells, shapes, factor):
+    '''
+    The shapes of cell_name, with its references expanded, from the
+    per-element shapes of every cell (cells: index into names per element),
+    scaled to user units.
+    '''
+    needed, _ = _reachable(cell_name, references, references)
+    own_shapes = {name: _empty_shapes() for name in references}
+    ids = {name: cell for cell, name in enumerate(names)}
+    for name in needed:
+        if name in ids:
+            mine = cells == ids[name]
+            own_shapes[name] = {key: shapes[key][mine] for key in SHAPE_FIELDS}
+    if len(needed) == 1:
+        shapes = own_shapes[cell_name]
+    else:
+        shapes = _resolve(cell_name, own_shapes, references, {})
+    factor = 1.0 if factor is None else factor
+    return {'boxes': factor * shapes['boxes'], 'layer': shapes['layer'],
+            'vertices': shapes['vertices'], 'area': factor ** 2 * shapes['area'],
+            'fill': shapes['fill']}
+
+
+def read_shapes(infile, layers=(2,), cell_match='MEA', follow_references=True, workers=1):
+    '''
+    Stream a GDSII file record by record and describe every BOUNDARY/BOX
+    element on one of layers in the first cell whose name contains
+    cell_match, without building a gdspy library.
+    With follow_references, electrodes placed through SREF/AREF (gdspy
+    CellReference/CellArray) are included too: the shapes of every
+    referenced cell are transformed once per reference transform and then
+    offset for all instances at once, so nothing is flattened.
+    With workers > 1, files of at least 2 * SHARD_MIN_BYTES are split into
+    byte-range shards scanned in a process pool, see _read_sharded; the
+    result is the same.
+    Returns (cell_name, shapes) where shapes holds one row per element:
+    - 'boxes': (N, 2, 2) [[x_min, y_min], [x_max, y_max]] in the file's user
+      units, the values gdspy's Polygon.get_bounding_box() gives for a library
+      loaded from infile (for referenced cells: for the flattened polygons),
+    - 'layer': (N,) GDS layer,
+    - 'vertices': (N,) vertex count without the closing point,
+    - 'area': (N,) polygon area in user units squared,
+    - 'fill': (N,) area over the area of the element's bounding box in the cell
+      it is drawn in, so the same under any rotation or magnification of the
+      references placing it.
+    '''
+    if workers > 1 and os.path.getsize(infile) >= 2 * SHARD_MIN_BYTES:
+        return _read_sharded(infile, layers, cell_match, follow_references, workers)
+
+    with open(infile, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        scan = _scan(mm, layers=layers, follow_references=follow_references, cell_match=cell_match)
+        if scan.cell_name is None:
+            raise ValueError(f"No cell containing '{cell_match}' found in GDS file.")
+        # only the cells the MEA cell instantiates matter
+        references = scan.references_by_name()
+        needed, _ = _reachable(scan.cell_name, references, references)
+        shapes = scan.shapes(mm, keep=np.array([name in needed for name in scan.names], dtype=bool))
+    return scan.cell_name, _assemble(scan.cell_name, scan.names, references, shapes['cell'], shapes, scan.factor)
+
+
+def _read_sharded(infile, layers, cell_match, follow_references, workers):
+    '''
+    read_shapes over byte-range shards. Every shard starts on what looks like
+    a BOUNDARY/BOX element and runs to the first one at or after the next
+    shard's start, so elements never straddle shards. The merge walks the
+    shards in order: a shard that did not start exactly where the previous one
+    ended (it synchronised on coordinates that only looked like a record) is
+    scanned again from there. Cells and references are then stitched across
+    shard borders: the elements before the first STRNAME of a shard belong to
+    the cell open at the end of the previous one.
+    '''
+    size = os.path.getsize(infile)
+    n_shards = max(1, min(workers, size // SHARD_MIN_BYTES))
+    with open(infile, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        starts = sorted({0, *(_shard_start(mm, size * k // n_shards) for k in range(1, n_shards))} - {size})
+    stops = starts[1:] + [size]
+
+    names, ids_by_name, references, cells, parts = [], {}, {}, [], []
+    factor = None
+    expected = 0
+    open_cell = None
+    with ProcessPoolExecutor(max_workers=len(starts)) as pool:
+        futures = [pool.submit(_read_shard, infile, start, stop, layers, follow_references)
+                   for start, stop in zip(starts, stops)]
+        for future, stop in zip(futures, stops):
+            try:
+                scan, shapes = future.result()
+            except Exception:
+                # a shard that synchronised on coordinates can fail in any way; it is scanned again
+                scan = None
+            if scan is None or scan.start != expected:
+                scan, shapes = _read_shard(infile, expected, stop, layers, follow_references)
+
+            ids = []
+            for cell, name in enumerate(scan.names):
+                name = open_cell if name is None else name
+                if name is not None and name not in references:
+                    references[name] = []
+                    ids_by_name[name] = len(names)
+                    names.append(name)
+                if name is not None:
+                    references[name].extend(scan.references[cell])
+                ids.append(ids_by_name[name] if name is not None else -1)
+            cells.append(np.asarray(ids, dtype=np.int64)[shapes['cell']])
+            parts.append(shapes)
+            factor = scan.factor if factor is None else factor
+            open_cell = None if scan.last_cell is None else (
+                scan.names[scan.last_cell] if scan.names[scan.last_cell] is not None else open_cell)
+            expected = scan.end
+            if scan.ended:
+                for rest in futures:
+                    rest.cancel()
+                break
+
+    cell_name = next((name for name in names if cell_match in name), None)
+    if cell_name is None:
+        raise ValueError(f"No cell containing '{cell_match}' found in GDS file.")
+    shapes = {key: np.concatenate([part[key] for part in parts]) for key in SHAPE_FIELDS}
+    return cell_name, _assemble(cell_name, names, references, np.concatenate(cells), shapes, factor)
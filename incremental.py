@@ -0,0 +1,102 @@
+import json
+
+import numpy as np
+
+from position_io import atomic_output
+from spatial import ElectrodeIndex, median_spacing
+
+# electrodes within MATCH_TOLERANCE (simulator micrometers) of their previous position are unchanged
+MATCH_TOLERANCE = 1e-3
+# farther than that but within MOVE_FRACTION of the pitch, and mutually closest, they have moved
+MOVE_FRACTION = 0.5
+
+
+def estimate_frame(previous_xy, centers):
+    '''
+    Scale and offset mapping raw GDS centres onto the simulator coordinates of
+    a previous extraction, previous_xy ~ centers * scale + offset for every
+    electrode that did not change. The scale is the ratio of the median
+    spacings and the offset the median displacement between nearest
+    neighbours, so a few added, removed or moved electrodes do not bias it.
+    '''
+    pitch = median_spacing(previous_xy)
+    scale = pitch / median_spacing(centers)
+    offset = previous_xy.mean(axis=0) - centers.mean(axis=0) * scale
+    index = ElectrodeIndex(previous_xy)
+    for _ in range(2):
+        mapped = centers * scale + offset
+        d, nearest = index.nearest(mapped)
+        close = d < pitch / 2
+        if not close.any():
+            break
+        offset = offset + np.median(previous_xy[nearest[close]] - mapped[close], axis=0)
+    return scale, offset
+
+
+def match_electrodes(previous_xy, current_xy, max_move):
+    '''
+    One-to-one matching of current to previous positions: a pair matches when
+    each is the other's nearest neighbour and they are at most max_move apart.
+    Returns (previous index of every current electrode or -1, distance).
+    '''
+    d, nearest = ElectrodeIndex(previous_xy).nearest(current_xy)
+    _, back = ElectrodeIndex(current_xy).nearest(previous_xy)
+    matched = (back[nearest] == np.arange(len(current_xy))) & (d <= max_move)
+    return np.where(matched, nearest, -1), d
+
+
+def diff_electrodes(previous_records, centers, tol=MATCH_TOLERANCE, max_move=None):
+    '''
+    Carry the labels of a previous extraction (POSITION_DTYPE records, see
+    position_io) over to new raw centres.
+
+    Returns (labels, adjusted, scale, diff): the label and simulator position of
+    every centre in input order, the scale of the previous frame, and a dict
+    listing the added, removed and moved electrodes. Matched electrodes keep
+    their label; unchanged ones also keep their exact previous coordinates.
+    New electrodes are labelled after the previous maximum, left-to-right,
+    bottom-to-top.
+    '''
+    previous_xy = np.column_stack((previous_records['x'], previous_records['y']))
+    previous_labels = np.asarray(previous_records['index'], dtype=np.int64)
+    scale, offset = estimate_frame(previous_xy, centers)
+    adjusted = centers * scale + offset
+    if max_move is None:
+        max_move = MOVE_FRACTION * median_spacing(previous_xy)
+
+    source, distance = match_electrodes(previous_xy, adjusted, max_move)
+    matched = source >= 0
+    unchanged = matched & (distance <= tol)
+    moved = matched & ~unchanged
+    adjusted[unchanged] = previous_xy[source[unchanged]]
+
+    labels = np.empty(len(centers), dtype=np.int64)
+    labels[matched] = previous_labels[source[matched]]
+    added = np.flatnonzero(~matched)
+    added = added[np.lexsort((adjusted[added, 0], adjusted[added, 1]))]
+    first_new = previous_labels.max() + 1 if len(previous_labels) else 0
+    labels[added] = first_new + np.arange(len(added))
+
+    removed = np.ones(len(previous_xy), dtype=bool)
+    removed[source[matched]] = False
+    moved = np.flatnonzero(moved)
+    moved = moved[np.argsort(labels[moved])]
+    diff = {
+        'unchanged': int(unchanged.sum()),
+        'added': np.column_stack((labels[added], adjusted[added])).tolist(),
+        'removed': np.column_stack((previous_labels[removed], previous_xy[removed])).tolist(),
+        'moved': np.column_stack((labels[moved], previous_xy[source[moved]], adjusted[moved])).tolist(),
+    }
+    for key in ('added', 'removed', 'moved'):
+        for row in diff[key]:
+            row[0] = int(row[0])
+    return labels, adjusted, scale, diff
+
+
+def write_diff(path, diff, previous=None):
+    '''
+    Write the diff as compact JSON: "added" and "removed" rows are [label, x, y],
+    "moved" rows are [label, old_x, old_y, new_x, new_y].
+    '''
+    with atomic_output(path) as tmp_path, open(tmp_path, 'w') as f:
+        json.dump({'previous': None if previous is None else str(previous), **diff}, f, separators=(',', ':'))
@@ -0,0 +1,225 @@
+import functools
+import json
+import sys
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+# the active Profiler, or None when instrumentation is off
+_profiler = None
+
+
+class _Stage:
+    '''
+    Handle yielded by stage(); set .count to the number of electrodes/shapes the stage produced.
+    '''
+    __slots__ = ('name', 'count')
+
+    def __init__(self, name):
+        self.name = name
+        self.count = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+# shared no-op stage handed out while profiling is disabled, so a disabled stage costs one global lookup
+_NULL_STAGE = _Stage(None)
+
+
+class Profiler:
+    '''
+    Collects one record per finished stage: its '/'-joined path (nested stages
+    are prefixed with their parents), wall time, optional count and, with
+    track_memory, the tracemalloc peak reached while the stage was running.
+    Every thread has its own stage stack; a worker thread continues the path
+    of the stage that started it through thread_stages().
+    '''
+
+    def __init__(self, track_memory=False, context=None):
+        self.track_memory = track_memory
+        self.context = dict(context or {})
+        self.records = []
+        self._local = threading.local()
+
+    def _thread(self):
+        '''
+        Stage stack of the calling thread and the path it was started under.
+        '''
+        local = self._local
+        if not hasattr(local, 'stack'):
+            local.stack = []
+            local.prefix = []
+        return local
+
+    @property
+    def _stack(self):
+        return self._thread().stack
+
+    def path(self):
+        '''
+        Names of the open stages of the calling thread, outermost first.
+        '''
+        local = self._thread()
+        return local.prefix + [f['handle'].name for f in local.stack]
+
+    def _enter(self, handle):
+        frame = {'handle': handle, 'start': time.perf_counter(), 'parent_peak': 0}
+        if self.track_memory:
+            frame['parent_peak'] = tracemalloc.get_traced_memory()[1]
+            tracemalloc.reset_peak()
+        self._stack.append(frame)
+
+    def _exit(self):
+        seconds = time.perf_counter() - self._stack[-1]['start']
+        names = self.path()
+        path = '/'.join(names)
+        frame = self._stack.pop()
+        peak = None
+        if self.track_memory:
+            peak = max(tracemalloc.get_traced_memory()[1], frame.get('child_peak', 0))
+            # reset_peak() lost the parent's peak so far, carry it up the stack instead
+            if self._stack:
+                parent = self._stack[-1]
+                parent['child_peak'] = max(parent.get('child_peak', 0), peak, frame['parent_peak'])
+        self.records.append({**self.context, 'stage': path, 'depth': len(names) - 1,
+                             'seconds': seconds, 'count': frame['handle'].count, 'peak_bytes': peak})
+
+    def summary(self):
+        '''
+        Records aggregated per stage path, in first-seen order.
+        '''
+        totals = {}
+        for r in self.records:
+            t = totals.setdefault(r['stage'], {'stage': r['stage'], 'calls': 0, 'seconds': 0.0,
+                                               'count': None, 'peak_bytes': None})
+            t['calls'] += 1
+            t['seconds'] += r['seconds']
+            if r['count'] is not None:
+                t['count'] = max(t['count'] or 0, r['count'])
+            if r['peak_bytes'] is not None:
+                t['peak_bytes'] = max(t['peak_bytes'] or 0, r['peak_bytes'])
+        return list(totals.values())
+
+    def print_summary(self, stream=sys.stdout):
+        print_summary(self.summary(), stream=stream)
+
+    def write_jsonl(self, path, mode='a'):
+        write_jsonl(self.records, path, mode=mode)
+
+
+def print_summary(rows, stream=sys.stdout):
+    width = max([len('stage')] + [len(r['stage']) for r in rows])
+    print(f"{'stage':<{width}}  {'calls':>5}  {'seconds':>9}  {'count':>8}  {'peak MB':>8}", file=stream)
+    for r in rows:
+        count = '-' if r['count'] is None else r['count']
+        peak = '-' if r['peak_bytes'] is None else f"{r['peak_bytes'] / 2**20:.1f}"
+        print(f"{r['stage']:<{width}}  {r['calls']:>5}  {r['seconds']:>9.4f}  {count:>8}  {peak:>8}",
+              file=stream)
+
+
+def write_jsonl(records, path, mode='a'):
+    with open(path, mode) as f:
+        for r in records:
+            f.write(json.dumps(r) + '\n')
+
+
+class _ActiveStage(_Stage):
+    __slots__ = ('profiler',)
+
+    def __init__(self, name, profiler):
+        super().__init__(name)
+        self.profiler = profiler
+
+    def __enter__(self):
+        self.profiler._enter(self)
+        return self
+
+    def __exit__(self, *exc):
+        self.profiler._exit()
+        return False
+
+
+def stage(name):
+    '''
+    Context manager timing one named pipeline stage:
+
+        with stage('remove_outliers') as s:
+            boxes = filter_outlier_boxes(boxes)
+            s.count = len(boxes)
+
+    It does nothing unless a profiling() block is active.
+    '''
+    if _profiler is None:
+        return _NULL_STAGE
+    return _ActiveStage(name, _profiler)
+
+
+def timed(name):
+    '''
+    Decorator form of stage() for whole functions.
+    '''
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if _profiler is None:
+                return func(*args, **kwargs)
+            with _ActiveStage(name, _profiler):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def tracking_memory():
+    '''
+    True inside a profiling(track_memory=True) block.
+    '''
+    return _profiler is not None and _profiler.track_memory
+
+
+def stage_path():
+    '''
+    Names of the open stages of the calling thread, to hand to thread_stages(), or None when profiling is off.
+    '''
+    return None if _profiler is None else _profiler.path()
+
+
+@contextmanager
+def thread_stages(path):
+    '''
+    Run the block in a worker thread as if nested in the stages of path (from
+    stage_path() in the thread that started it). A no-op in that thread itself.
+    '''
+    if _profiler is None or not path or _profiler.path() == list(path):
+        yield
+        return
+    local = _profiler._thread()
+    previous, local.prefix = local.prefix, list(path)
+    try:
+        yield
+    finally:
+        local.prefix = previous
+
+
+@contextmanager
+def profiling(track_memory=False, context=None):
+    '''
+    Enable instrumentation for the duration of the block and yield the Profiler.
+    '''
+    global _profiler
+    previous = _profiler
+    profiler = Profiler(track_memory=track_memory, context=context)
+    started_tracemalloc = track_memory and not tracemalloc.is_tracing()
+    if started_tracemalloc:
+        tracemalloc.start()
+    _profiler = profiler
+    try:
+        yield profiler
+    finally:
+        _profiler = previous
+        if started_tracemalloc:
+            tracemalloc.stop()
@@ -0,0 +1,130 @@
+import argparse
+import json
+import os
+import struct
+import uuid
+from contextlib import contextmanager
+from pathlib import Path
+
+import numpy as np
+
+# one record per electrode, packed little-endian so the file can be memory-mapped as-is
+POSITION_DTYPE = np.dtype([('index', '<i4'), ('x', '<f8'), ('y', '<f8'), ('z', '<f8')])
+
+# .epos header: magic, version, electrode count, bounding box (min_x, min_y, max_x, max_y), zero padding
+BINARY_MAGIC = b'EPOS'
+BINARY_VERSION = 1
+BINARY_SUFFIX = '.epos'
+HEADER_SIZE = 64
+_HEADER = struct.Struct('<4sII4d')
+
+
+@contextmanager
+def atomic_output(path):
+    '''
+    Yield a temporary path next to path and move it into place only when the
+    block succeeds, so readers never see a partially written output.
+    '''
+    path = os.fspath(path)
+    tmp_path = f'{path}.{uuid.uuid4().hex[:8]}.tmp'
+    try:
+        yield tmp_path
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        raise
+
+
+def make_records(centers, z=100.0, index=None):
+    '''
+    Structured POSITION_DTYPE array for centres that are already in label order.
+    index defaults to 0, 1, 2, ...
+    '''
+    records = np.empty(len(centers), dtype=POSITION_DTYPE)
+    records['index'] = np.arange(len(centers)) if index is None else index
+    records['x'] = centers[:, 0]
+    records['y'] = centers[:, 1]
+    records['z'] = z
+    return records
+
+
+def write_positions_json(path, records, bounding_box, compact=False):
+    '''
+    Write the simulator JSON. compact=True drops the indentation and spaces,
+    which makes the file several times smaller and faster to parse.
+    '''
+    with atomic_output(path) as tmp_path, open(tmp_path, 'w') as f:
+        json.dump({
+            "electrode_coordinates": [list(r) for r in records.tolist()],
+            "bounding_box": bounding_box
+        }, f, **({'separators': (',', ':')} if compact else {'indent': 2}))
+
+
+def write_positions_binary(path, records, bounding_box):
+    (min_x, min_y), (max_x, max_y) = bounding_box
+    header = _HEADER.pack(BINARY_MAGIC, BINARY_VERSION, len(records), min_x, min_y, max_x, max_y)
+    with atomic_output(path) as tmp_path, open(tmp_path, 'wb') as f:
+        f.write(header.ljust(HEADER_SIZE, b'\0'))
+        f.write(np.ascontiguousarray(records, dtype=POSITION_DTYPE).tobytes())
+
+
+def read_positions_binary(path, mmap=True):
+    '''
+    Return (records, bounding_box). With mmap=True the records are a read-only
+    np.memmap over the file, so nothing is copied until it is accessed.
+    '''
+    with open(path, 'rb') as f:
+        magic, version, count, min_x, min_y, max_x, max_y = _HEADER.unpack(f.read(_HEADER.size))
+    if magic != BINARY_MAGIC:
+        raise ValueError(f'{path} is not an electrode position file.')
+    if version != BINARY_VERSION:
+        raise ValueError(f'Unsupported electrode position file version {version} in {path}.')
+    if mmap and count:
+        records = np.memmap(path, dtype=POSITION_DTYPE, mode='r', offset=HEADER_SIZE, shape=(count,))
+    else:
+        records = np.fromfile(path, dtype=POSITION_DTYPE, count=count, offset=HEADER_SIZE)
+    return records, [[min_x, min_y], [max_x, max_y]]
+
+
+def read_positions_json(path):
+    with open(path) as f:
+        data = json.load(f)
+    coordinates = data["electrode_coordinates"]
+    records = np.empty(len(coordinates), dtype=POSITION_DTYPE)
+    if coordinates:
+        values = np.asarray(coordinates, dtype=float)
+        records['index'] = values[:, 0]
+        records['x'] = values[:, 1]
+        records['y'] = values[:, 2]
+        records['z'] = values[:, 3]
+    return records, data["bounding_box"]
+
+
+def load_positions(path):
+    '''
+    Read either format, chosen by file extension.
+    '''
+    if Path(path).suffix == BINARY_SUFFIX:
+        return read_positions_binary(path)
+    return read_positions_json(path)
+
+
+def convert_positions(src, dst, compact=False):
+    '''
+    Convert between the JSON and .epos formats, chosen by file extension.
+    '''
+    records, bounding_box = load_positions(src)
+    if Path(dst).suffix == BINARY_SUFFIX:
+        write_positions_binary(dst, records, bounding_box)
+    else:
+        write_positions_json(dst, records, bounding_box, compact=compact)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Convert electrode position files between JSON and .epos.')
+    parser.add_argument('src')
+    parser.add_argument('dst')
+    parser.add_argument('--compact', action='store_true', help='write JSON without indentation')
+    args = parser.parse_args()
+    convert_positions(args.src, args.dst, compact=args.compact)
@@ -1,41 +1,75 @@
+import argparse
+import glob
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import cached_property
+from pathlib import Path
+
 import gdspy
-import json
 import numpy as np
 
+from cache import DEFAULT_CACHE_DIR, DEFAULT_MAX_BYTES, ExtractionCache
+from classify import (CLASS_RULES, CLASSES, ELECTRODE_CLASSES, RECORDING, STIMULUS, classify_shapes, rule_layers,
+                      select_electrodes, size_groups)
+from gds_stream import read_shapes
+from incremental import MATCH_TOLERANCE, diff_electrodes, write_diff
+from instrument import Profiler, profiling, stage, stage_path, thread_stages, timed, tracking_memory, write_jsonl
+from position_io import (BINARY_SUFFIX, atomic_output, load_positions, make_records, write_positions_binary,
+                         write_positions_json)
+from spatial import median_spacing
+
 FILE_NAME = 'MEA512.gds'
+OUTPUT_DIR = './electrode_positions'
 
 SIMULATOR_GRID_SIZE = (4000, 4000)  # in micrometers (4 mm x 4 mm)
 DISTANCE_BETWEEN_ELECTRODES = 180
 ELECTRODE_DIAMETER = 30  # in micrometers
+SIZE_TOLERANCE = 1e-6  # bounding boxes whose width/height differ by less are the same size
+DEDUP_DECIMALS = 3
+GDS_PRECISION = 1e-3  # in micrometers, the 1 nm database unit of the written GDS files
+
+# outputs write_outputs can produce, see there
+OUTPUTS = ('json', 'gds', 'binary', 'confirmation', 'diff')
+DEFAULT_OUTPUTS = ('json', 'gds', 'confirmation')
+
+
+def as_point_array(electrode_positions):
+    '''
+    Accept a set/list of (x, y) tuples or an (N, 2) array and return an (N, 2) float array.
+    '''
+    if isinstance(electrode_positions, (set, frozenset)):
+        electrode_positions = list(electrode_positions)
+    return np.asarray(electrode_positions, dtype=float).reshape(-1, 2)
+
+
+def label_order(centers):
+    '''
+    Indices that sort centres left-to-right, bottom-to-top (by y first, then x).
+    '''
+    return np.lexsort((centers[:, 0], centers[:, 1]))
+
 
 def add_labels(electrode_positions): 
     '''
     Add labels to electrode positions.
     Order = left-to-right, bottom-to-top based on coordinates.
     '''
-    # sort by y first (ascending), then x
-    sorted_positions = sorted(electrode_positions, key=lambda p: (p[1], p[0]))
-    positions_with_labels = [(i, x, y) for i, (x, y) in enumerate(sorted_positions)]
-    return positions_with_labels
+    centers = as_point_array(electrode_positions)
+    sorted_positions = centers[label_order(centers)]
+    return [(i, x, y) for i, (x, y) in enumerate(sorted_positions.tolist())]
 
-def adjust_electrode_positions(electrode_positions, stimulus=None):
+
+def rescale_centers(centers):
     """
-    Rescale and translate electrode positions so that:
-    1. Distances between nearest neighbors match DISTANCE_BETWEEN_ELECTRODES (edge-to-edge).
-    2. The MEA is centered in the simulator grid.
+    Array version of adjust_electrode_positions: returns (adjusted (N, 2) array, scale_factor).
     """
-    electrode_positions = np.array(list(electrode_positions), dtype=float)
-
     # --- Step 1: Normalize (make mean-centered) ---
-    mean_x, mean_y = electrode_positions.mean(axis=0)
-    centered = electrode_positions - np.array([mean_x, mean_y])
+    centered = centers - centers.mean(axis=0)
 
     # --- Step 2: Compute nearest-neighbor distance ---
-    nearest_dists = []
-    for i in range(len(centered)):
-        dists_i = [np.linalg.norm(centered[i] - centered[j]) for j in range(len(centered)) if i != j]
-        nearest_dists.append(min(dists_i))
-    avg_spacing = np.median(nearest_dists)
+    avg_spacing = median_spacing(centered)
 
     # --- Step 3: Desired spacing = distance between centers = gap + diameter ---
     desired_spacing = DISTANCE_BETWEEN_ELECTRODES
@@ -48,25 +82,37 @@ def adjust_electrode_positions(electrode_positions, stimulus=None):
     target_center = np.array(SIMULATOR_GRID_SIZE) / 2
     adjusted = scaled + target_center
 
-    return [tuple(p) for p in adjusted]
+    return adjusted, scale_factor
 
 
-def remove_outliers(electrode_positions):
-    metrics = {}
-    for bouding_box in electrode_positions:
-        width = bouding_box[1][0] - bouding_box[0][0]
-        height = bouding_box[1][1] - bouding_box[0][1]
-        if (width, height) in metrics:
-            metrics[(width, height)] += 1
-        else:
-            metrics[(width, height)] = 1
-    most_common = max(metrics, key=metrics.get)
-    filtered_bounding_boxes = [bb for bb in electrode_positions if (bb[1][0] - bb[0][0], bb[1][1] - bb[0][1]) == most_common]
+def adjust_electrode_positions(electrode_positions, stimulus=None):
+    """
+    Rescale and translate electrode positions so that:
+    1. Distances between nearest neighbors match DISTANCE_BETWEEN_ELECTRODES (edge-to-edge).
+    2. The MEA is centered in the simulator grid.
+    """
+    adjusted, _ = rescale_centers(as_point_array(electrode_positions))
+    return [tuple(p) for p in adjusted.tolist()]
+
+
+def filter_outlier_boxes(bounding_boxes, tol=SIZE_TOLERANCE):
+    '''
+    Keep only the boxes whose (width, height) is the most common one, comparing
+    sizes up to tol. Ties go to the size that appears first, as in the old dict count.
+    '''
+    bounding_boxes = np.asarray(bounding_boxes, dtype=float).reshape(-1, 2, 2)
+    if len(bounding_boxes) == 0:
+        raise ValueError('No bounding boxes found on the target layer.')
+    filtered_bounding_boxes = bounding_boxes[size_groups(bounding_boxes, tol)[0]]
     if len(filtered_bounding_boxes) == 0:
         raise ValueError('No bounding boxes found with the most common width and height.')
     return filtered_bounding_boxes
 
 
+def remove_outliers(electrode_positions):
+    return list(filter_outlier_boxes(electrode_positions))
+
+
 def draw_simulator_grid(MEA):
     min_x = 0
     max_x = SIMULATOR_GRID_SIZE[0]
@@ -85,32 +131,149 @@ def draw_dish(radius, MEA):
 
 
 
-def write_json(electrode_positions, clean_filename, stimulus=None):
-    adjusted_positions = adjust_electrode_positions(electrode_positions)
+def regular_lattice(positions, tol=GDS_PRECISION):
+    '''
+    If positions fill a complete axis-aligned lattice, return
+    (origin, spacing, columns, rows) for a gdspy.CellArray, otherwise None.
+    '''
+    if len(positions) == 0:
+        return None
+    keys = np.round(positions / tol).astype(np.int64)
+    xs, ys = np.unique(keys[:, 0]), np.unique(keys[:, 1])
+    n_unique = len(np.unique(keys, axis=0))
+    if n_unique != len(positions) or len(xs) * len(ys) != n_unique:
+        return None
+    spacing = []
+    for axis_values in (xs, ys):
+        steps = np.diff(axis_values)
+        if steps.size and np.ptp(steps) > 1:
+            return None
+        spacing.append(float(steps.mean()) * tol if steps.size else 0.0)
+    origin = (float(xs[0]) * tol, float(ys[0]) * tol)
+    return origin, tuple(spacing), len(xs), len(ys)
+
+
+def place_cell(target, cell, positions):
+    '''
+    Instantiate cell at every position in target: one CellArray when the positions
+    form a complete lattice, otherwise one CellReference each. Either way the
+    shape itself is only stored once.
+    '''
+    lattice = regular_lattice(positions)
+    if lattice is not None:
+        origin, spacing, columns, rows = lattice
+        target.add(gdspy.CellArray(cell, columns, rows, spacing, origin))
+    else:
+        target.add([gdspy.CellReference(cell, (x, y)) for x, y in positions.tolist()])
+
 
-    # Create new gds file for visualization
+def write_visualization_gds(labelled_positions, clean_filename, output_dir=OUTPUT_DIR, stimulus_mask=None):
+    '''
+    Write electrode_positions_<name>.gds (dots, simulator grid and dish) and
+    return the simulator bounding box (min_x, min_y, max_x, max_y).
+    Recording and stimulus electrodes (stimulus_mask) are placed separately,
+    so a regular recording array still collapses into one CellArray.
+    '''
     new_lib = gdspy.GdsLibrary()
-    new_cell = gdspy.Cell('Electrode_Positions')
-    electrode_positions_with_labels = add_labels(adjusted_positions)
-    for label, x, y in electrode_positions_with_labels:
-        dot = gdspy.Round((x, y),
-                        radius=ELECTRODE_DIAMETER / 2,
-                        inner_radius=0, number_of_points=60, layer=2)
-        new_cell.add(dot)
+    new_cell = gdspy.Cell('Electrode_Positions', exclude_from_current=True)
+    electrode_cell = gdspy.Cell('Electrode', exclude_from_current=True)
+    electrode_cell.add(gdspy.Round((0, 0),
+                                   radius=ELECTRODE_DIAMETER / 2,
+                                   inner_radius=0, number_of_points=60, layer=2))
+    stimulus_mask = np.zeros(len(labelled_positions), dtype=bool) if stimulus_mask is None else stimulus_mask
+    for group in (labelled_positions[~stimulus_mask], labelled_positions[stimulus_mask]):
+        if len(group):
+            place_cell(new_cell, electrode_cell, group)
 
     min_x, min_y, max_x, max_y = draw_simulator_grid(new_cell)
     draw_dish(radius=min(SIMULATOR_GRID_SIZE) / 2, MEA=new_cell)
     new_lib.add(new_cell)
-    new_lib.write_gds(f'./electrode_positions/electrode_positions_{clean_filename}.gds')
+    with atomic_output(f'{output_dir}/electrode_positions_{clean_filename}.gds') as tmp_path:
+        new_lib.write_gds(tmp_path)
+    return min_x, min_y, max_x, max_y
+
+
+@timed('write_json')
+def write_json(electrode_positions, clean_filename, stimulus=None, output_dir=OUTPUT_DIR,
+               compact=False, binary=False):
+    '''
+    Write the visualization GDS and the simulator JSON. compact=True writes the
+    JSON without indentation; binary=True also writes a memory-mappable .epos file.
+    '''
+    outputs = ('json', 'gds', 'binary') if binary else ('json', 'gds')
+    return write_outputs(electrode_positions, clean_filename, output_dir=output_dir, outputs=outputs,
+                         compact=compact)
+
+
+def write_outputs(electrode_positions, clean_filename, output_dir=OUTPUT_DIR, outputs=DEFAULT_OUTPUTS,
+                  MEA=None, lib=None, compact=False, overlay_only=False, threads=None):
+    '''
+    Write the selected outputs of one extraction concurrently on a thread pool:
+    - 'json' / 'binary': electrode_positions_<name>.json / .epos
+    - 'gds': the visualization GDS electrode_positions_<name>.gds
+    - 'confirmation': first_with_dots_<name>.gds (needs MEA and lib) or, with
+      overlay_only, dots_overlay_<name>.gds, see create_dots_confirmation
+    - 'diff': electrode_diff_<name>.json of an IncrementalResult
+    Every file is written under a temporary name and renamed into place when
+    complete. threads defaults to one per output; threads=1, like memory
+    profiling (whose peaks concurrent writers would mix up), writes them one
+    after the other. Returns {output: seconds}.
+    '''
+    result = as_result(electrode_positions)
+    unknown = set(outputs) - set(OUTPUTS)
+    if unknown:
+        raise ValueError(f'Unknown outputs: {sorted(unknown)}; choose from {OUTPUTS}.')
+    if 'diff' in outputs and not isinstance(result, IncrementalResult):
+        raise ValueError('The diff output needs an IncrementalResult.')
+    base = f'{output_dir}/electrode_positions_{clean_filename}'
+    writers = {
+        'json': lambda: write_positions_json(f'{base}.json', result.records, result.bounding_box, compact=compact),
+        'gds': lambda: write_visualization_gds(result.labelled_centers, clean_filename, output_dir,
+                                               stimulus_mask=result.stimulus_mask),
+        'binary': lambda: write_positions_binary(f'{base}{BINARY_SUFFIX}', result.records, result.bounding_box),
+        'confirmation': lambda: create_dots_confirmation(result, MEA, lib, clean_filename, output_dir=output_dir,
+                                                         overlay_only=overlay_only),
+        'diff': lambda: write_diff(f'{output_dir}/electrode_diff_{clean_filename}.json', result.diff,
+                                   previous=result.previous),
+    }
+    selected = [name for name in OUTPUTS if name in outputs]
+
+    with stage('write_outputs') as s:
+        # derive the shared arrays once, before the writers race for them
+        if selected:
+            result.records
+            result.stimulus_mask
+        parent = stage_path()
+
+        def run(name):
+            start = time.perf_counter()
+            with thread_stages(parent), stage(name) as writer_stage:
+                writers[name]()
+                writer_stage.count = len(result)
+            return time.perf_counter() - start
+
+        threads = len(selected) if threads is None else threads
+        if threads <= 1 or len(selected) <= 1 or tracking_memory():
+            seconds = [run(name) for name in selected]
+        else:
+            with ThreadPoolExecutor(max_workers=threads) as pool:
+                seconds = list(pool.map(run, selected))
+        s.count = len(selected)
+    return dict(zip(selected, seconds))
+
+
+def box_centers(bounding_boxes):
+    '''
+    Centres of an (N, 2, 2) array of bounding boxes as an (N, 2) array.
+    '''
+    return bounding_boxes.mean(axis=1)
 
-    # Write JSON
-    with open(f'./electrode_positions/electrode_positions_{clean_filename}.json', 'w') as f:
-        json.dump({
-            "electrode_coordinates": [
-                [i, x, y, 100.0] for i, x, y in electrode_positions_with_labels
-            ],
-            "bounding_box": [[min_x, min_y], [max_x, max_y]]
-        }, f, indent=2)
+
+def dedup_centers(centers, decimals=DEDUP_DECIMALS):
+    '''
+    Round to decimals and drop duplicate rows; the result is sorted by x, then y.
+    '''
+    return np.unique(np.round(centers, decimals), axis=0)
 
 
 def get_center(bouding_box):
@@ -126,60 +289,481 @@ def get_area_of_bouding_box(bounding_box):
     return width * height
 
 
-def get_electrodes(FILE_NAME, target_layer=2):
-    lib = gdspy.GdsLibrary(infile=FILE_NAME)
-    keys = list(lib.cells.keys())
-    mea_key = next((k for k in keys if 'MEA' in k), None)
-    if mea_key is None:
-        raise ValueError("No cell containing 'MEA' found in GDS file.")
-    MEA = lib.cells[mea_key]
+def extract_centers(FILE_NAME, target_layer=2, workers=1):
+    '''
+    Parse the GDS file and return (mea_key, deduplicated (N, 2) centres, (N,) class codes).
+    Every shape is classified once (see classify.CLASS_RULES); each class is then
+    filtered for outliers (see classify.select_electrodes) and deduplicated on its
+    own, and the centres are grouped by class.
+    With workers > 1 large files are parsed in byte-range shards by a process
+    pool (see gds_stream.read_shapes); outliers and duplicates are still
+    selected over the merged shapes, so shard borders do not matter.
+    '''
+    with stage('read_gds') as s:
+        mea_key, shapes = read_shapes(FILE_NAME, layers=rule_layers(target_layer), workers=workers)
+        s.count = len(shapes['boxes'])
+    with stage('classify') as s:
+        codes = classify_shapes(shapes, electrode_layer=target_layer)
+        s.count = int(np.count_nonzero(codes >= 0))
+    with stage('remove_outliers') as s:
+        selected = select_electrodes(shapes, codes, electrode_layer=target_layer, tol=SIZE_TOLERANCE)
+        present = np.fromiter(selected, dtype=np.int64, count=len(selected))
+        class_boxes = list(selected.values())
+        s.count = sum(len(boxes) for boxes in class_boxes)
+    if not np.isin([CLASSES.index(c) for c in ELECTRODE_CLASSES], present).any():
+        raise ValueError('No recording or stimulus electrodes found on the target layer.')
+    # deduplicate with rounding tolerance
+    with stage('dedup') as s:
+        class_centers = [dedup_centers(box_centers(boxes)) for boxes in class_boxes]
+        centers = np.concatenate(class_centers)
+        classes = np.repeat(present, [len(c) for c in class_centers])
+        s.count = len(centers)
+    return mea_key, centers, classes
+
 
-    clean_filename = FILE_NAME.split('.')[0]
-    quant_electrodes = int(clean_filename.split('_')[0][3:])
+class ExtractionResult:
+    '''
+    One extraction, shared by every writer. Only the deduplicated centres are
+    stored up front; the rescaled positions, labels, stimulus mask and output
+    records are computed on first access and then reused, so nothing is
+    computed twice or computed when no writer asks for it.
+    classes holds the class code (index into classify.CLASSES) of every centre,
+    all recording electrodes by default. Only the ELECTRODE_CLASSES are kept as
+    electrodes; the raw centres of the other classes (reference, ground) are
+    in .auxiliary, keyed by class name.
+    '''
 
-    polygons = MEA.polygons
-    polygons_filtered = [p for p in polygons if p.layers[0] == target_layer]
+    def __init__(self, centers, mea_key=None, classes=None):
+        centers = as_point_array(centers)
+        if classes is None:
+            classes = np.full(len(centers), CLASSES.index(RECORDING), dtype=np.int64)
+        classes = np.asarray(classes, dtype=np.int64).reshape(len(centers))
+        written = np.isin(classes, [CLASSES.index(c) for c in ELECTRODE_CLASSES])
+        self.centers = centers[written]
+        self.classes = classes[written]
+        self.auxiliary = {CLASSES[code]: centers[classes == code] for code in np.unique(classes[~written])}
+        self.mea_key = mea_key
+
+    def __len__(self):
+        return len(self.centers)
+
+    def __array__(self, dtype=None, copy=None):
+        return self.centers if dtype is None else self.centers.astype(dtype)
+
+    @cached_property
+    def _rescaled(self):
+        with stage('rescale') as s:
+            adjusted, scale_factor = rescale_centers(self.centers)
+            s.count = len(adjusted)
+        return adjusted, scale_factor
+
+    @property
+    def adjusted_centers(self):
+        '''
+        Centres rescaled to DISTANCE_BETWEEN_ELECTRODES and centred in the simulator grid, in input order.
+        '''
+        return self._rescaled[0]
+
+    @property
+    def scale_factor(self):
+        return self._rescaled[1]
+
+    @cached_property
+    def order(self):
+        '''
+        Input index of the electrode with label 0, 1, 2, ...: recording electrodes
+        first, then stimulus electrodes, each left-to-right, bottom-to-top.
+        '''
+        with stage('label'):
+            adjusted = self.adjusted_centers
+            return np.lexsort((adjusted[:, 0], adjusted[:, 1], self.classes))
+
+    @cached_property
+    def labels(self):
+        '''
+        Label of every centre, in input order.
+        '''
+        labels = np.empty(len(self), dtype=np.int64)
+        labels[self.order] = np.arange(len(self))
+        return labels
+
+    @cached_property
+    def labelled_centers(self):
+        return self.adjusted_centers[self.order]
+
+    @cached_property
+    def stimulus_mask(self):
+        '''
+        True for stimulus electrodes, in label order.
+        '''
+        return self.classes[self.order] == CLASSES.index(STIMULUS)
+
+    @property
+    def bounding_box(self):
+        return [[0, 0], [SIMULATOR_GRID_SIZE[0], SIMULATOR_GRID_SIZE[1]]]
+
+    @cached_property
+    def records(self):
+        return make_records(self.labelled_centers)
+
+
+class IncrementalResult(ExtractionResult):
+    '''
+    An ExtractionResult laid out like a previous extraction (its POSITION_DTYPE
+    records): positions are mapped into the previous simulator frame, matched
+    electrodes keep their label and unchanged ones their exact coordinates, so
+    downstream data keyed on electrode index stays valid. New electrodes are
+    labelled after the previous maximum, so a new recording electrode can come
+    after the stimulus ones and the output is no longer recording first. The
+    stimulus mask comes from the class codes of the new extraction, not from
+    the previous output. .diff lists what was added, removed and moved.
+    '''
 
-    bounding_boxes_electrodes = [p.get_bounding_box() for p in polygons_filtered]
-    electrode_positions = remove_outliers(bounding_boxes_electrodes)
-    electrode_positions = [get_center(bb) for bb in electrode_positions]
+    def __init__(self, centers, previous_records, mea_key=None, classes=None, tol=MATCH_TOLERANCE,
+                 max_move=None, previous=None):
+        super().__init__(centers, mea_key=mea_key, classes=classes)
+        self.previous_records = previous_records
+        self.previous = previous  # path of the previous output, recorded in the diff
+        self.tol = tol
+        self.max_move = max_move
 
-    # deduplicate with rounding tolerance
-    electrode_positions = {(round(x, 3), round(y, 3)) for x, y in electrode_positions}
-    
+    @cached_property
+    def _matched(self):
+        with stage('match_previous') as s:
+            labels, adjusted, scale_factor, diff = diff_electrodes(self.previous_records, self.centers,
+                                                                   tol=self.tol, max_move=self.max_move)
+            s.count = len(diff['added']) + len(diff['removed']) + len(diff['moved'])
+        return labels, adjusted, scale_factor, diff
+
+    @cached_property
+    def _rescaled(self):
+        return self._matched[1], self._matched[2]
+
+    @cached_property
+    def labels(self):
+        return self._matched[0]
+
+    @cached_property
+    def order(self):
+        return np.argsort(self.labels, kind='stable')
+
+    @property
+    def diff(self):
+        return self._matched[3]
+
+    @cached_property
+    def records(self):
+        return make_records(self.labelled_centers, index=self.labels[self.order])
+
+
+def as_result(electrode_positions):
+    if isinstance(electrode_positions, ExtractionResult):
+        return electrode_positions
+    return ExtractionResult(electrode_positions)
+
+
+def extract(FILE_NAME, target_layer=2, cache=None, workers=1):
+    '''
+    Extract the electrode centres (through the cache when one is given)
+    without writing anything. workers, see extract_centers.
+    '''
+    cached = None
+    if cache is not None:
+        with stage('cache_lookup'):
+            cache_key = cache.key(FILE_NAME, target_layer=target_layer, rules=CLASS_RULES)
+            cached = cache.get(cache_key)
+    if cached is not None:
+        mea_key, centers, classes = cached
+    else:
+        mea_key, centers, classes = extract_centers(FILE_NAME, target_layer=target_layer, workers=workers)
+        if cache is not None:
+            with stage('cache_store'):
+                cache.put(cache_key, mea_key, centers, classes)
+    return ExtractionResult(centers, mea_key=mea_key, classes=classes)
+
+
+def extract_incremental(FILE_NAME, previous, target_layer=2, cache=None, tol=MATCH_TOLERANCE, max_move=None,
+                        workers=1):
+    '''
+    Extract FILE_NAME and carry over the labels of a previous
+    electrode_positions_*.json (or .epos) output; returns an IncrementalResult.
+    New electrodes get labels after the previous maximum, possibly after the
+    stimulus electrodes, so the records are ordered by label rather than
+    recording first.
+    '''
+    with stage('read_previous') as s:
+        records, _ = load_positions(previous)
+        # copy out of a memory-mapped .epos, which is about to be overwritten
+        records = np.array(records)
+        s.count = len(records)
+    result = extract(FILE_NAME, target_layer=target_layer, cache=cache, workers=workers)
+    incremental = IncrementalResult(result.centers, records, mea_key=result.mea_key, classes=result.classes,
+                                    tol=tol, max_move=max_move, previous=previous)
+    incremental.auxiliary = result.auxiliary
+    return incremental
+
+
+def previous_output(clean_filename, output_dir=OUTPUT_DIR):
+    '''
+    The electrode_positions_<name>.json (or .epos) left by an earlier run, or None.
+    '''
+    for suffix in ('.json', BINARY_SUFFIX):
+        path = Path(output_dir) / f'electrode_positions_{clean_filename}{suffix}'
+        if path.exists():
+            return path
+    return None
+
+
+@timed('get_electrodes')
+def get_electrodes(FILE_NAME, target_layer=2, load_library=True, output_dir=OUTPUT_DIR, cache=None,
+                   compact=False, binary=False, previous=None, outputs=None, overlay_only=False,
+                   writer_threads=None, workers=1):
+    '''
+    Extract electrode centres from the first cell containing 'MEA'.
+    The bounding boxes come from the streaming GDSII reader; the full gdspy
+    library is only loaded when load_library is True (needed by
+    create_dots_confirmation), otherwise MEA and lib are returned as None.
+    With an ExtractionCache, a hit skips parsing entirely and the outputs are
+    regenerated from the cached centres.
+    The first return value is an ExtractionResult; pass it on to
+    create_dots_confirmation so the rescaled positions are reused.
+    With previous (the path of an earlier electrode_positions_* output), labels
+    are kept stable against it and electrode_diff_<name>.json is written.
+    outputs selects what write_outputs writes; by default the JSON and the
+    visualization GDS, plus the .epos with binary and the diff with previous.
+    workers > 1 parses large files in parallel shards, see extract_centers.
+    '''
+    clean_filename = Path(FILE_NAME).stem
+    if outputs is None:
+        outputs = ('json', 'gds') + (('binary',) if binary else ()) + (('diff',) if previous is not None else ())
+    if previous is not None:
+        electrode_positions = extract_incremental(FILE_NAME, previous, target_layer=target_layer, cache=cache,
+                                                  workers=workers)
+    else:
+        electrode_positions = extract(FILE_NAME, target_layer=target_layer, cache=cache, workers=workers)
+
+    if load_library:
+        with stage('load_library'):
+            lib = gdspy.GdsLibrary(infile=FILE_NAME)
+            MEA = lib.cells[electrode_positions.mea_key]
+    else:
+        lib, MEA = None, None
+
+    # quant_electrodes = int(clean_filename.split('_')[0][3:])
     # if len(electrode_positions) != quant_electrodes:
     #     raise ValueError(
     #         f'Number of electrodes in GDS ({len(electrode_positions)}) '
     #         f'does not match expected ({quant_electrodes}).'
     #     )
 
-    write_json(electrode_positions, clean_filename)
+    write_outputs(electrode_positions, clean_filename, output_dir=output_dir, outputs=outputs, MEA=MEA, lib=lib,
+                  compact=compact, overlay_only=overlay_only, threads=writer_threads)
     return electrode_positions, MEA, lib, clean_filename
 
 
-def create_dots_confirmation(electrode_positions, MEA, lib, clean_filename):
-    adjusted_positions = adjust_electrode_positions(electrode_positions)
+@timed('create_dots_confirmation')
+def create_dots_confirmation(electrode_positions, MEA, lib, clean_filename, output_dir=OUTPUT_DIR,
+                             overlay_only=False):
+    '''
+    Mark the detected electrodes with small dots (squares for stimulus electrodes)
+    on layer 0. By default the dots are added to the MEA cell and the whole
+    original library is written to first_with_dots_<name>.gds. With
+    overlay_only=True, MEA and lib are not needed: only the dots are written to
+    dots_overlay_<name>.gds, to be loaded on top of the original layout.
+    '''
+    result = as_result(electrode_positions)
+    stimulus_electrodes = result.labelled_centers[result.stimulus_mask]
+    normal_electrodes = result.labelled_centers[~result.stimulus_mask]
+
+    with stage('draw_dots') as s:
+        stimulus_cell = gdspy.Cell('Confirmation_Stimulus', exclude_from_current=True)
+        stimulus_cell.add(gdspy.Rectangle((-10, -10), (10, 10), layer=0))
+        dot_cell = gdspy.Cell('Confirmation_Dot', exclude_from_current=True)
+        dot_cell.add(gdspy.Round((0, 0), radius=3, inner_radius=0,
+                                 number_of_points=16, layer=0))
+        if overlay_only:
+            lib = gdspy.GdsLibrary()
+            MEA = gdspy.Cell('Confirmation_Overlay', exclude_from_current=True)
+            lib.add(MEA)
+        if len(stimulus_electrodes):
+            place_cell(MEA, stimulus_cell, stimulus_electrodes)
+            lib.add(stimulus_cell, overwrite_duplicate=True)
+        if len(normal_electrodes):
+            place_cell(MEA, dot_cell, normal_electrodes)
+            lib.add(dot_cell, overwrite_duplicate=True)
+        s.count = len(result)
+    with stage('write_gds'):
+        prefix = 'dots_overlay' if overlay_only else 'first_with_dots'
+        with atomic_output(f'{output_dir}/{prefix}_{clean_filename}.gds') as tmp_path:
+            lib.write_gds(tmp_path)
+
+
+def process_file(file_name, target_layer=2, output_dir=OUTPUT_DIR, confirmation=True, cache=None,
+                 compact=False, binary=False, overlay_only=False, incremental=False, outputs=None,
+                 writer_threads=None, workers=1):
+    '''
+    Run the full extraction for one GDS file and return the number of electrodes found.
+    With incremental=True, labels follow the previous output in output_dir when there is one.
+    outputs (see write_outputs) overrides confirmation and binary; the diff is
+    added whenever there is a previous output.
+    '''
+    if outputs is None:
+        outputs = ('json', 'gds') + (('binary',) if binary else ()) + (('confirmation',) if confirmation else ())
+    previous = previous_output(Path(file_name).stem, output_dir) if incremental else None
+    if previous is not None:
+        outputs = tuple(outputs) + ('diff',)
+    electrode_positions, _, _, _ = get_electrodes(
+        file_name, target_layer=target_layer, load_library='confirmation' in outputs and not overlay_only,
+        output_dir=output_dir, cache=cache, compact=compact, previous=previous, outputs=outputs,
+        overlay_only=overlay_only, writer_threads=writer_threads, workers=workers)
+    return len(electrode_positions)
+
+
+def _run_job(file_name, options, profile=None):
+    '''
+    Process-pool worker: never raises, so one broken file cannot take the batch down.
+    With profile = {'track_memory': bool}, the per-stage records are returned under 'stages'.
+    '''
+    start = time.perf_counter()
+    records = []
+    try:
+        if profile is None:
+            n_electrodes = process_file(file_name, **options)
+        else:
+            with profiling(context={'file': file_name}, **profile) as profiler:
+                try:
+                    n_electrodes = process_file(file_name, **options)
+                finally:
+                    records = profiler.records
+        status, error = 'ok', ''
+    except Exception as exc:
+        n_electrodes = None
+        status, error = 'failed', f'{type(exc).__name__}: {exc}'
+    return {'file': file_name, 'status': status, 'electrodes': n_electrodes,
+            'seconds': time.perf_counter() - start, 'error': error, 'stages': records}
+
+
+def expand_inputs(patterns):
+    '''
+    Expand files, directories (all *.gds inside) and glob patterns into a list
+    of GDS paths, keeping the first occurrence of each file.
+    '''
+    files = []
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            matches = sorted(glob.glob(os.path.join(pattern, '*.gds')))
+        else:
+            matches = sorted(glob.glob(pattern)) or [pattern]
+        files.extend(m for m in matches if m not in files)
+    return files
+
+
+def print_summary(results, total_seconds, stream=sys.stdout):
+    width = max([len('file')] + [len(r['file']) for r in results])
+    print(f"{'file':<{width}}  {'status':<6}  {'electrodes':>10}  {'seconds':>8}", file=stream)
+    for r in results:
+        n = '-' if r['electrodes'] is None else r['electrodes']
+        print(f"{r['file']:<{width}}  {r['status']:<6}  {n:>10}  {r['seconds']:>8.2f}", file=stream)
+        if r['error']:
+            print(f"    {r['error']}", file=stream)
+    n_failed = sum(r['status'] != 'ok' for r in results)
+    print(f'{len(results)} file(s), {n_failed} failed, wall time {total_seconds:.2f} s', file=stream)
+
+
+def print_stage_summary(records, stream=sys.stdout):
+    profiler = Profiler()
+    profiler.records = records
+    profiler.print_summary(stream=stream)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Extract MEA electrode positions from GDS files.')
+    parser.add_argument('inputs', nargs='*', default=[FILE_NAME],
+                        help='GDS files, directories or glob patterns (default: %(default)s)')
+    parser.add_argument('-j', '--jobs', type=int, default=os.cpu_count(),
+                        help='number of worker processes (default: number of CPUs)')
+    parser.add_argument('-o', '--output-dir', default=OUTPUT_DIR,
+                        help='directory for the generated files (default: %(default)s)')
+    parser.add_argument('--layer', type=int, default=2, help='electrode layer (default: %(default)s)')
+    parser.add_argument('--no-confirmation', action='store_true',
+                        help='skip the first_with_dots_*.gds confirmation file')
+    parser.add_argument('--overlay-only', action='store_true',
+                        help='write only the confirmation dots to dots_overlay_*.gds instead of '
+                             'rewriting the whole original layout')
+    parser.add_argument('--compact-json', action='store_true',
+                        help='write the JSON without indentation')
+    parser.add_argument('--binary', action='store_true',
+                        help=f'also write a memory-mappable electrode_positions_*{BINARY_SUFFIX} file')
+    parser.add_argument('--outputs', nargs='+', choices=OUTPUTS[:-1], metavar='OUTPUT',
+                        help='outputs to write, any of %(choices)s (default: json gds confirmation; '
+                             '--no-confirmation and --binary adjust it)')
+    parser.add_argument('--writer-threads', type=int, default=None,
+                        help='threads writing the outputs of a file, 1 writes them one after the other '
+                             '(default: one per output)')
+    parser.add_argument('--shard-workers', type=int, default=None,
+                        help='processes parsing one large GDS file in byte-range shards '
+                             '(default: -j for a single input file, otherwise 1)')
+    parser.add_argument('--incremental', action='store_true',
+                        help='keep the labels of the electrode_positions_* output already in the output '
+                             'directory and write the changes to electrode_diff_*.json')
+    parser.add_argument('--profile', action='store_true',
+                        help='time every pipeline stage and print a per-stage summary')
+    parser.add_argument('--profile-memory', action='store_true',
+                        help='with --profile, also track the tracemalloc peak of every stage')
+    parser.add_argument('--profile-jsonl', metavar='PATH',
+                        help='with --profile, append one JSON line per stage and file to PATH')
+    parser.add_argument('--cache', action='store_true',
+                        help='reuse extracted centres from the on-disk cache when the GDS file is unchanged')
+    parser.add_argument('--cache-dir', default=DEFAULT_CACHE_DIR, help='cache directory (default: %(default)s)')
+    parser.add_argument('--cache-max-mb', type=float, default=DEFAULT_MAX_BYTES / 2**20,
+                        help='cache size cap in MB, least recently used entries are evicted (default: %(default)s)')
+    parser.add_argument('--cache-info', action='store_true', help='print cache statistics and exit')
+    parser.add_argument('--cache-clear', action='store_true', help='remove every cache entry and exit')
+    args = parser.parse_args(argv)
+
+    cache = ExtractionCache(args.cache_dir, max_bytes=int(args.cache_max_mb * 2**20))
+    if args.cache_clear:
+        print(f'Removed {cache.clear()} cache entries from {cache.cache_dir}')
+        return 0
+    if args.cache_info:
+        info = cache.info()
+        print(f"{info['cache_dir']}: {info['entries']} entries, "
+              f"{info['total_bytes'] / 2**20:.1f} / {info['max_bytes'] / 2**20:.1f} MB")
+        return 0
 
-    # last 4 electrodes are assumed to be stimulus electrodes (if applicable)
-    if len(adjusted_positions) > 4:
-        stimulus_electrodes = adjusted_positions[-4:]
-        normal_electrodes = adjusted_positions[:-4]
+    files = expand_inputs(args.inputs)
+    os.makedirs(args.output_dir, exist_ok=True)
+    outputs = list(args.outputs or DEFAULT_OUTPUTS)
+    if args.no_confirmation and 'confirmation' in outputs:
+        outputs.remove('confirmation')
+    if args.binary and 'binary' not in outputs:
+        outputs.append('binary')
+    options = {'target_layer': args.layer, 'output_dir': args.output_dir,
+               'cache': cache if args.cache else None, 'compact': args.compact_json,
+               'overlay_only': args.overlay_only, 'incremental': args.incremental, 'outputs': tuple(outputs),
+               'writer_threads': args.writer_threads}
+    # a single file gets the -j processes for its shards, a batch one process per file
+    options['workers'] = args.shard_workers or (args.jobs or 1 if len(files) == 1 else 1)
+
+    profile = {'track_memory': args.profile_memory} if args.profile else None
+
+    start = time.perf_counter()
+    jobs = max(1, min(args.jobs or 1, len(files)))
+    if jobs == 1:
+        results = [_run_job(f, options, profile) for f in files]
     else:
-        stimulus_electrodes = []
-        normal_electrodes = adjusted_positions
-
-    for pos in stimulus_electrodes:
-        box = gdspy.Rectangle((pos[0] - 10, pos[1] - 10),
-                            (pos[0] + 10, pos[1] + 10), layer=0)
-        MEA.add(box)
-    for pos in normal_electrodes:
-        dot = gdspy.Round(pos, radius=3, inner_radius=0,
-                        number_of_points=16, layer=0)
-        MEA.add(dot)
-    lib.write_gds(f'./electrode_positions/first_with_dots_{clean_filename}.gds')
+        with ProcessPoolExecutor(max_workers=jobs) as pool:
+            results = list(pool.map(_run_job, files, [options] * len(files), [profile] * len(files)))
+    print_summary(results, time.perf_counter() - start)
+    if profile is not None:
+        for r in results:
+            if r['stages']:
+                print(f"\n{r['file']}")
+                print_stage_summary(r['stages'])
+        if args.profile_jsonl:
+            write_jsonl([rec for r in results for rec in r['stages']], args.profile_jsonl)
+    return 1 if any(r['status'] != 'ok' for r in results) else 0
 
 
 if __name__ == '__main__':
-    electrode_positions, MEA, lib, clean_filename = get_electrodes(FILE_NAME)
-    create_dots_confirmation(electrode_positions, MEA, lib, clean_filename)
-    print(f'Electrode positions saved to electrode_positions_{FILE_NAME.split(".")[0]}.json')
+    sys.exit(main())
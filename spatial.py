@@ -0,0 +1,344 @@
+import numpy as np
+
+from position_io import load_positions
+
+try:
+    from scipy.spatial import cKDTree
+except ImportError:  # scipy is optional, the grid hash below covers the same queries
+    cKDTree = None
+
+# below this many points a dense pairwise distance matrix is cheaper than building an index
+BRUTE_FORCE_LIMIT = 512
+
+# query points handled per batch by ElectrodeIndex.nearest without scipy
+QUERY_CHUNK = 8192
+
+
+def _as_points(points):
+    points = np.asarray(list(points) if isinstance(points, (set, frozenset)) else points, dtype=float)
+    return points.reshape(-1, 2)
+
+
+def _brute_nearest(points):
+    '''
+    Nearest-neighbour distance for every point with a dense distance matrix.
+    '''
+    diff = points[:, None, :] - points[None, :, :]
+    dists = np.hypot(diff[..., 0], diff[..., 1])
+    np.fill_diagonal(dists, np.inf)
+    return dists.min(axis=1)
+
+
+def _expand_ranges(starts, counts):
+    '''
+    Concatenate np.arange(start, start + count) for every (start, count) pair.
+    '''
+    total = int(counts.sum())
+    offsets = np.arange(total) - np.repeat(np.cumsum(counts) - counts, counts)
+    return np.repeat(starts, counts) + offsets
+
+
+def _grid_nearest(points, cell_size=None):
+    '''
+    Nearest-neighbour distance for every point using a uniform grid hash.
+    Each point only looks at the 3x3 block of cells around it; any point whose
+    best candidate is farther than one cell is retried with a doubled cell size.
+    '''
+    n = len(points)
+    origin = points.min(axis=0)
+    extent = points.max(axis=0) - origin
+    if cell_size is None:
+        # aim for roughly one point per cell
+        area = extent[0] * extent[1]
+        cell_size = np.sqrt(area / n) if area > 0 else max(extent.max(), 1.0) / n
+    cell_size = max(float(cell_size), 1e-9)
+
+    nearest = np.full(n, np.inf)
+    pending = np.arange(n)
+    while pending.size:
+        cells = np.floor((points - origin) / cell_size).astype(np.int64)
+        stride = cells[:, 1].max() + 3
+        keys = (cells[:, 0] + 1) * stride + (cells[:, 1] + 1)
+        order = np.argsort(keys, kind='stable')
+        sorted_keys = keys[order]
+
+        best = np.full(pending.size, np.inf)
+        for dx in (-1, 0, 1):
+            for dy in (-1, 0, 1):
+                neighbour_keys = keys[pending] + dx * stride + dy
+                starts = np.searchsorted(sorted_keys, neighbour_keys, side='left')
+                counts = np.searchsorted(sorted_keys, neighbour_keys, side='right') - starts
+                if not counts.any():
+                    continue
+                owner = np.repeat(np.arange(pending.size), counts)
+                candidates = order[_expand_ranges(starts, counts)]
+                d = np.hypot(*(points[candidates] - points[pending[owner]]).T)
+                d[candidates == pending[owner]] = np.inf
+                # owner is sorted, so each point's candidates form one contiguous run
+                has_candidates = counts > 0
+                run_starts = (np.cumsum(counts) - counts)[has_candidates]
+                best[has_candidates] = np.minimum(best[has_candidates], np.minimum.reduceat(d, run_starts))
+
+        resolved = best <= cell_size
+        nearest[pending[resolved]] = best[resolved]
+        pending = pending[~resolved]
+        cell_size *= 2
+    return nearest
+
+
+def nearest_neighbour_distances(points, method='auto'):
+    '''
+    Distance from every point to its closest other point.
+    method = 'auto' | 'kdtree' | 'grid' | 'brute'. 'auto' uses a scipy KD-tree when
+    scipy is installed and falls back to the NumPy grid hash otherwise; tiny inputs
+    always use the dense pairwise matrix.
+    '''
+    points = _as_points(points)
+    if len(points) < 2:
+        raise ValueError('At least two points are needed to compute nearest-neighbour distances.')
+
+    if method == 'auto':
+        if len(points) <= BRUTE_FORCE_LIMIT:
+            method = 'brute'
+        else:
+            method = 'kdtree' if cKDTree is not None else 'grid'
+
+    if method == 'brute':
+        return _brute_nearest(points)
+    if method == 'grid':
+        return _grid_nearest(points)
+    if method == 'kdtree':
+        if cKDTree is None:
+            raise ImportError("method='kdtree' requires scipy.")
+        dists, _ = cKDTree(points).query(points, k=2)
+        return dists[:, 1]
+    raise ValueError(f'Unknown nearest-neighbour method: {method!r}')
+
+
+def median_spacing(points, method='auto'):
+    '''
+    Median nearest-neighbour distance, i.e. the electrode pitch of a regular array.
+    '''
+    return float(np.median(nearest_neighbour_distances(points, method=method)))
+
+
+def _as_queries(points, name='points'):
+    points = np.asarray(points, dtype=float)
+    if points.ndim == 1:
+        points = points.reshape(1, -1)
+    if points.ndim != 2 or points.shape[1] != 2:
+        raise ValueError(f'{name} must be an (x, y) pair or an (N, 2) array.')
+    if not np.isfinite(points).all():
+        raise ValueError(f'{name} must be finite.')
+    return points
+
+
+class ElectrodeIndex:
+    '''
+    Spatial index over electrode positions answering batched queries:
+
+        index = ElectrodeIndex.from_file('electrode_positions/electrode_positions_MEA512.json')
+        distances, labels = index.nearest(cell_xy)             # closest electrode per cell
+        query, labels, distances = index.within_radius(stim_xy, 150.0)
+        query, labels = index.within_box(lower_left, upper_right)
+
+    Every method takes an (N, 2) array of query points (or a single pair) and
+    returns electrode labels, i.e. the index column of the position file.
+    Radius and box queries return flat arrays of (query, electrode) pairs sorted
+    by query, so neighbours of query i are labels[query == i].
+
+    Electrodes are bucketed into vertical strips about one pitch wide and sorted by
+    (strip, y); box and radius queries binary-search the y range they cover in
+    every strip they cross. nearest() uses a scipy KD-tree when available
+    (method='auto') and otherwise grows a search circle until it holds k electrodes.
+    '''
+
+    def __init__(self, positions, labels=None, method='auto'):
+        self.positions = _as_points(positions)
+        n = len(self.positions)
+        if n == 0:
+            raise ValueError('Cannot index an empty set of electrodes.')
+        if not np.isfinite(self.positions).all():
+            raise ValueError('Electrode positions must be finite.')
+        self.labels = np.arange(n) if labels is None else np.asarray(labels).reshape(n)
+        if method not in ('auto', 'kdtree', 'grid'):
+            raise ValueError(f'Unknown nearest-neighbour method: {method!r}')
+        if method == 'kdtree' and cKDTree is None:
+            raise ImportError("method='kdtree' requires scipy.")
+        self.method = 'kdtree' if method == 'auto' and cKDTree is not None else method
+        self._tree = None
+
+        self.lower = self.positions.min(axis=0)
+        self.upper = self.positions.max(axis=0)
+        # about one electrode per strip_width x strip_width cell, as in _grid_nearest
+        extent = self.upper - self.lower
+        area = extent[0] * extent[1]
+        self.strip_width = max(np.sqrt(area / n) if area > 0 else max(extent.max(), 1.0) / n, 1e-9)
+        # through _strip, so the rightmost electrodes always fall into the last strip
+        self.n_strips = int(self._strip(self.upper[:1])[0]) + 1
+        strips = self._strip(self.positions[:, 0])
+        # one sortable key per electrode: strip number, then y inside the strip;
+        # y offsets stay below _y_span, so strips never interleave
+        self._y_span = float(self.upper[1] - self.lower[1]) + 1.0
+        keys = strips * self._y_span + (self.positions[:, 1] - self.lower[1])
+        self._order = np.argsort(keys, kind='stable')
+        self._keys = keys[self._order]
+
+    @classmethod
+    def from_records(cls, records, method='auto'):
+        '''
+        Index a POSITION_DTYPE record array (see position_io).
+        '''
+        return cls(np.column_stack((records['x'], records['y'])), labels=np.asarray(records['index']),
+                   method=method)
+
+    @classmethod
+    def from_file(cls, path, method='auto'):
+        '''
+        Index a write_json output (.json) or its binary .epos counterpart.
+        '''
+        records, _ = load_positions(path)
+        return cls.from_records(records, method=method)
+
+    @classmethod
+    def from_result(cls, result, method='auto'):
+        '''
+        Index an in-memory script.ExtractionResult, using the same rescaled,
+        labelled coordinates write_json writes.
+        '''
+        return cls.from_records(result.records, method=method)
+
+    def __len__(self):
+        return len(self.positions)
+
+    def _strip(self, x):
+        return np.floor((x - self.lower[0]) / self.strip_width).astype(np.int64)
+
+    def _strips_between(self, x_lower, x_upper):
+        '''
+        (query, strip) pairs for every strip overlapping each query's [x_lower, x_upper].
+        '''
+        first = np.clip(self._strip(x_lower), 0, self.n_strips)
+        last = np.clip(self._strip(x_upper), -1, self.n_strips - 1)
+        counts = np.maximum(last - first + 1, 0)
+        return np.repeat(np.arange(len(x_lower)), counts), _expand_ranges(first, counts)
+
+    def _scan_strips(self, query, strips, y_lower, y_upper):
+        '''
+        (query, electrode) pairs for the electrodes of each strip with y in [y_lower, y_upper].
+        '''
+        # clipped to the y range of the electrodes so a search never runs into the next strip
+        y_lower = np.clip(y_lower - self.lower[1], 0, self._y_span - 1)
+        y_upper = np.clip(y_upper - self.lower[1], 0, self._y_span - 1)
+        starts = np.searchsorted(self._keys, strips * self._y_span + y_lower, side='left')
+        stops = np.searchsorted(self._keys, strips * self._y_span + y_upper, side='right')
+        hits = np.maximum(stops - starts, 0)
+        return np.repeat(query, hits), self._order[_expand_ranges(starts, hits)]
+
+    def _box_candidates(self, lower, upper):
+        '''
+        (query, electrode) index pairs for every electrode inside each query's
+        [lower, upper] box, sorted by query.
+        '''
+        query, strips = self._strips_between(lower[:, 0], upper[:, 0])
+        query, electrodes = self._scan_strips(query, strips, lower[query, 1], upper[query, 1])
+        # the strips bound x only to the strip width, the y search is exact up to rounding
+        p = self.positions[electrodes]
+        inside = ((p >= lower[query]) & (p <= upper[query])).all(axis=1)
+        return query[inside], electrodes[inside]
+
+    def within_box(self, lower, upper):
+        '''
+        Electrodes inside the axis-aligned box [lower, upper] of every query
+        (boundaries included). lower and upper are (x, y) pairs or (N, 2) arrays.
+        Returns (query index, electrode label) arrays sorted by query.
+        '''
+        lower, upper = _as_queries(lower, 'lower'), _as_queries(upper, 'upper')
+        lower, upper = np.broadcast_arrays(lower, upper)
+        query, electrodes = self._box_candidates(lower, upper)
+        return query, self.labels[electrodes]
+
+    def _radius_candidates(self, points, radius):
+        radius = np.broadcast_to(np.asarray(radius, dtype=float), (len(points),))
+        query, strips = self._strips_between(points[:, 0] - radius, points[:, 0] + radius)
+        # only scan the chord of the circle that crosses each strip, not its whole bounding box
+        strip_x = self.lower[0] + strips * self.strip_width
+        dx = np.maximum(np.maximum(strip_x - points[query, 0], points[query, 0] - strip_x - self.strip_width), 0)
+        half = np.sqrt(np.maximum(radius[query] ** 2 - dx ** 2, 0)) * (1 + 1e-9)  # slack for rounding, d is exact
+        query, electrodes = self._scan_strips(query, strips, points[query, 1] - half, points[query, 1] + half)
+        d = np.hypot(*(self.positions[electrodes] - points[query]).T)
+        keep = d <= radius[query]
+        query, electrodes, d = query[keep], electrodes[keep], d[keep]
+        order = np.lexsort((d, query))
+        return query[order], electrodes[order], d[order]
+
+    def within_radius(self, points, radius):
+        '''
+        Electrodes within radius (a scalar or one value per query) of every query point.
+        Returns (query index, electrode label, distance) arrays sorted by query,
+        then by distance.
+        '''
+        points = _as_queries(points)
+        query, electrodes, d = self._radius_candidates(points, radius)
+        return query, self.labels[electrodes], d
+
+    def _k_nearest_inside(self, points, k):
+        '''
+        k nearest electrodes of points inside the electrode bounding box: the
+        search circle grows until it holds k electrodes.
+        '''
+        distances = np.full((len(points), k), np.inf)
+        electrodes = np.zeros((len(points), k), dtype=np.int64)
+        extent = np.maximum(self.upper - self.lower, self.strip_width)
+        # a circle expected to hold about 2k electrodes
+        radius = np.full(len(points), np.sqrt(2 * k * extent[0] * extent[1] / (np.pi * len(self))))
+        pending = np.arange(len(points))
+        while pending.size:
+            query, found, d = self._radius_candidates(points[pending], radius[pending])
+            rank = np.arange(len(query)) - np.searchsorted(query, query)
+            has_k = np.bincount(query, minlength=pending.size) >= k
+            take = (rank < k) & has_k[query]
+            rows = pending[query[take]]
+            distances[rows, rank[take]] = d[take]
+            electrodes[rows, rank[take]] = found[take]
+            radius[pending[~has_k]] *= 2
+            pending = pending[~has_k]
+        return distances, electrodes
+
+    def _grid_k_nearest(self, points, k):
+        # the k electrodes closest to the query clamped into the bounding box bound
+        # the k-th distance of an outside query, so one exact radius search finishes it
+        clamped = np.clip(points, self.lower, self.upper)
+        distances, electrodes = self._k_nearest_inside(clamped, k)
+        outside = np.flatnonzero((clamped != points).any(axis=1))
+        if outside.size:
+            bound = np.hypot(*(self.positions[electrodes[outside]] - points[outside, None, :]).T).max(axis=0)
+            query, found, d = self._radius_candidates(points[outside], bound * (1 + 1e-9))
+            rank = np.arange(len(query)) - np.searchsorted(query, query)
+            take = rank < k
+            distances[outside[query[take]], rank[take]] = d[take]
+            electrodes[outside[query[take]], rank[take]] = found[take]
+        return distances, electrodes
+
+    def nearest(self, points, k=1):
+        '''
+        The k closest electrodes of every query point.
+        Returns (distances, labels): shape (N,) for k=1, (N, k) sorted by distance otherwise.
+        '''
+        points = _as_queries(points)
+        if not 1 <= k <= len(self):
+            raise ValueError(f'k must be between 1 and the number of electrodes ({len(self)}).')
+        if self.method == 'kdtree':
+            if self._tree is None:
+                self._tree = cKDTree(self.positions)
+            distances, electrodes = self._tree.query(points, k=k)
+            distances, electrodes = distances.reshape(len(points), k), electrodes.reshape(len(points), k)
+        else:
+            # chunked so far-away queries, which see many candidates each, stay bounded in memory
+            results = [self._grid_k_nearest(points[i:i + QUERY_CHUNK], k)
+                       for i in range(0, len(points), QUERY_CHUNK)]
+            distances = np.concatenate([r[0] for r in results]) if results else np.empty((0, k))
+            electrodes = np.concatenate([r[1] for r in results]) if results else np.empty((0, k), np.int64)
+        if k == 1:
+            distances, electrodes = distances[:, 0], electrodes[:, 0]
+        return distances, self.labels[electrodes]
@@ -0,0 +1,21 @@
+import sys
+from pathlib import Path
+
+# the modules are flat scripts, not a package: import them from the repository root
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+sys.path.insert(0, str(ROOT / 'eval_mea'))
+
+
+def grid(columns, rows, pitch, row_pitch=None, hexagonal=False):
+    '''
+    (columns * rows, 2) centres of a regular grid from the origin, row by row;
+    row_pitch defaults to pitch, hexagonal shifts every other row by half a pitch.
+    '''
+    import numpy as np
+
+    row_pitch = pitch if row_pitch is None else row_pitch
+    x, y = np.meshgrid(np.arange(columns) * pitch, np.arange(rows) * row_pitch)
+    if hexagonal:
+        x = x + (np.arange(rows)[:, None] % 2) * pitch / 2
+    return np.column_stack((x.ravel(), y.ravel())).astype(float)
@@ -0,0 +1,32 @@
+import numpy as np
+import pytest
+
+from cache import ExtractionCache
+
+
+@pytest.fixture
+def gds(tmp_path):
+    path = tmp_path / 'MEA4.gds'
+    path.write_bytes(b'not really a layout')
+    return path
+
+
+def test_round_trip(tmp_path, gds):
+    cache = ExtractionCache(tmp_path / 'cache')
+    key = cache.key(gds, target_layer=2)
+    assert cache.get(key) is None
+    cache.put(key, 'MEA_4', np.arange(8.0).reshape(4, 2), np.zeros(4, dtype=np.int64))
+    cell_name, centres, classes = cache.get(key)
+    assert cell_name == 'MEA_4'
+    np.testing.assert_array_equal(centres, np.arange(8.0).reshape(4, 2))
+
+
+@pytest.mark.parametrize('keep', [0, 10, 200, -20])
+def test_truncated_entry_is_a_miss(tmp_path, gds, keep):
+    cache = ExtractionCache(tmp_path / 'cache')
+    key = cache.key(gds, target_layer=2)
+    cache.put(key, 'MEA_4', np.arange(8.0).reshape(4, 2), np.zeros(4, dtype=np.int64))
+    path = tmp_path / 'cache' / f'{key}.npz'
+    path.write_bytes(path.read_bytes()[:keep])
+    assert cache.get(key) is None
+    assert not path.exists()
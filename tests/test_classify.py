@@ -0,0 +1,86 @@
+import sys
+from pathlib import Path
+
+import gdspy
+import numpy as np
+import pytest
+
+import script
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'benchmarks'))
+from synthetic import write_mea_gds  # noqa: E402
+
+
+def array_layout(path, electrode, rotation=0, extra=()):
+    '''
+    8x8 CellArray of electrode (a polygon on layer 2) in a MEA cell, plus extra shapes.
+    '''
+    lib = gdspy.GdsLibrary()
+    cell = gdspy.Cell('ELECTRODE', exclude_from_current=True)
+    cell.add(electrode)
+    mea = gdspy.Cell('MEA_64', exclude_from_current=True)
+    mea.add(gdspy.CellArray(cell, 8, 8, (200, 200), rotation=rotation))
+    mea.add(list(extra))
+    lib.add([cell, mea])
+    lib.write_gds(str(path))
+    return str(path)
+
+
+def regular_polygon(n, radius=15.0, phase=0.0):
+    angles = np.arange(n) * 2 * np.pi / n + phase
+    return gdspy.Polygon(np.column_stack((radius * np.cos(angles), radius * np.sin(angles))), layer=2)
+
+
+@pytest.mark.parametrize('n_stimulus', [0, 4])
+def test_stray_rectangles_are_not_stimulus_electrodes(tmp_path, n_stimulus):
+    path = str(tmp_path / 'MEA64.gds')
+    write_mea_gds(path, 64, n_stimulus=n_stimulus, n_outliers=8)
+    result = script.extract(path)
+    assert len(result) == 64 + n_stimulus
+    assert result.stimulus_mask.sum() == n_stimulus
+
+
+def test_same_size_bond_pads_do_not_outnumber_stimulus_pads(tmp_path):
+    bond_pads = [gdspy.Rectangle((x, -3000), (x + 400, -2600), layer=2) for x in range(0, 6000, 500)]
+    stimulus = [gdspy.Rectangle((x - 10, -210), (x + 10, -190), layer=2) for x in (0, 200, 400, 600)]
+    path = array_layout(tmp_path / 'MEA68.gds', gdspy.Round((0, 0), 15, number_of_points=64, layer=2),
+                        extra=bond_pads + stimulus)
+    result = script.extract(path)
+    assert len(result) == 68
+    np.testing.assert_allclose(np.sort(result.centers[result.stimulus_mask, 0]), [0, 200, 400, 600])
+
+
+def test_rounds_in_a_rotated_array_are_recording_electrodes(tmp_path):
+    path = array_layout(tmp_path / 'MEA64.gds', gdspy.Round((0, 0), 15, number_of_points=64, layer=2),
+                        rotation=45)
+    result = script.extract(path)
+    assert len(result) == 64
+    assert not result.stimulus_mask.any()
+
+
+@pytest.mark.parametrize('electrode', [
+    regular_polygon(6),
+    regular_polygon(8, phase=np.pi / 8),
+    # a cross matches no rule; it is kept as the most common size on the electrode layer
+    gdspy.Polygon([(-5, -15), (5, -15), (5, -5), (15, -5), (15, 5), (5, 5), (5, 15), (-5, 15),
+                   (-5, 5), (-15, 5), (-15, -5), (-5, -5)], layer=2),
+])
+def test_other_electrode_outlines_are_recording_electrodes(tmp_path, electrode):
+    path = array_layout(tmp_path / 'MEA64.gds', electrode,
+                        extra=[gdspy.Rectangle((0, -2000), (300, -1700), layer=2)])
+    result = script.extract(path)
+    assert len(result) == 64
+    assert not result.stimulus_mask.any()
+
+
+def test_square_electrode_array_is_recording(tmp_path):
+    lib = gdspy.GdsLibrary()
+    mea = gdspy.Cell('MEA_400', exclude_from_current=True)
+    mea.add([gdspy.Rectangle((x - 4, y - 4), (x + 4, y + 4), layer=2)
+             for x in range(0, 360, 18) for y in range(0, 360, 18)])
+    mea.add([gdspy.Rectangle((x - 2, -20), (x + 2, -16), layer=2) for x in (0, 18)])
+    lib.add(mea)
+    lib.write_gds(str(tmp_path / 'MEA400.gds'))
+    result = script.extract(str(tmp_path / 'MEA400.gds'))
+    assert len(result) == 402
+    assert result.stimulus_mask.sum() == 2
@@ -0,0 +1,36 @@
+import numpy as np
+import pytest
+
+import eval_mea
+from map_registry import MapRegistry
+
+
+def test_compare_mappings_without_pairs(capsys):
+    with pytest.raises(SystemExit) as exit_info:
+        eval_mea.compare_mappings(pairs={})
+    assert exit_info.value.code == 2
+    assert 'No map pairs' in capsys.readouterr().err
+
+
+def test_compare_mappings_with_empty_maps_directory(tmp_path, monkeypatch, capsys):
+    monkeypatch.setattr(eval_mea, 'MAPS', MapRegistry(tmp_path))
+    with pytest.raises(SystemExit) as exit_info:
+        eval_mea.compare_mappings()
+    assert exit_info.value.code == 2
+    assert str(tmp_path) in capsys.readouterr().err
+
+
+def test_compare_mappings_with_a_clean_pair(tmp_path, capsys):
+    csv_path = tmp_path / 'map.csv'
+    csv_path.write_text('old,new\n1,10\n2,20\n3,30\n4,40\n')
+    pairs = {'clean': ([[1, 2], [3, 4]], [[10, 20], [30, 40]], csv_path)}
+    summary, report = eval_mea.compare_mappings(pairs, report_path=tmp_path / 'report.csv')
+    assert summary.loc['clean', 'mismatches'] == 0
+    assert len(report) == 0 and list(report.columns) == eval_mea.REPORT_COLUMNS
+    assert 'No mismatches' in capsys.readouterr().out
+    assert not (tmp_path / 'report.csv').exists()
+
+
+def test_build_lookup_rejects_negative_channels():
+    with pytest.raises(ValueError):
+        eval_mea.build_lookup(np.array([-1, 2]), np.array([10, 20]))
@@ -0,0 +1,164 @@
+import gdspy
+import numpy as np
+import pytest
+
+import gds_stream
+
+# a point whose XY bytes read as a BOUNDARY record followed by a LAYER record
+DECOY_POINT = (0x00040800 / 1000, 0x00060D02 / 1000)
+LAYERS = (2, 3, 4)
+RESCANS = []
+
+
+def hierarchical_layout(path, decoy=False):
+    '''
+    Write a MEA cell with shapes drawn in it and placed through nested SREFs
+    and AREFs with rotation, reflection and magnification; referenced cells
+    are written both before and after the MEA cell. Returns path as a str.
+    '''
+    early = gdspy.Cell('EARLY', exclude_from_current=True)
+    early.add(gdspy.Round((5, 3), 15, number_of_points=64, layer=2))
+    early.add(gdspy.Rectangle((-4, -4), (6, 2), layer=3))
+    late = gdspy.Cell('LATE', exclude_from_current=True)
+    late.add(gdspy.Rectangle((0, 0), (20, 10), layer=2))
+    late.add(gdspy.Polygon([(0, 0), (8, 0), (12, 6), (4, 9)], layer=4))
+    block = gdspy.Cell('BLOCK', exclude_from_current=True)
+    block.add(gdspy.CellReference(late, (100, 0), rotation=90, magnification=2, x_reflection=True))
+    block.add(gdspy.CellArray(early, 3, 2, (60, 80), (0, 200), rotation=180))
+    unused = gdspy.Cell('UNUSED', exclude_from_current=True)
+    unused.add(gdspy.Rectangle((0, 0), (1, 1), layer=2))
+
+    mea = gdspy.Cell('MEA_TEST', exclude_from_current=True)
+    for i in range(150):
+        mea.add(gdspy.Round((i * 200, -1000), 15, number_of_points=60 if i % 2 else 64, layer=2))
+        mea.add(gdspy.Rectangle((i * 200 - 2, -1100), (i * 200 + 2, -1015), layer=1))
+    if decoy:
+        mea.add(gdspy.Polygon([DECOY_POINT, (300, DECOY_POINT[1]), (300, 420)], layer=2))
+    mea.add(gdspy.CellArray(block, 4, 3, (500, 600), (0, 2000), rotation=270, x_reflection=True))
+    mea.add(gdspy.CellReference(early, (-300, -300), magnification=1.5))
+    mea.add(gdspy.CellArray(late, 5, 5, (40, 40), (-2000, 0), rotation=90, magnification=0.5))
+    for i in range(150):
+        mea.add(gdspy.Round((i * 200, 5000), 15, number_of_points=64, layer=2))
+
+    lib = gdspy.GdsLibrary()
+    lib.add(early)
+    lib.add(unused)
+    lib.add(mea, include_dependencies=False)
+    lib.add(block, include_dependencies=False)
+    lib.add(late)
+    lib.write_gds(str(path))
+    return str(path)
+
+
+def test_cells_referenced_after_unrelated_cells_are_read(tmp_path):
+    lib = gdspy.GdsLibrary()
+    electrode = gdspy.Cell('ELECTRODE', exclude_from_current=True)
+    electrode.add(gdspy.Round((0, 0), 15, number_of_points=64, layer=2))
+    row = gdspy.Cell('ROW', exclude_from_current=True)
+    row.add(gdspy.CellArray(electrode, 8, 1, (200, 200)))
+    mea = gdspy.Cell('MEA_64', exclude_from_current=True)
+    mea.add(gdspy.CellArray(row, 1, 8, (200, 200)))
+    lib.add(mea, include_dependencies=False)
+    for i in range(200):
+        filler = gdspy.Cell(f'FILLER_{i}', exclude_from_current=True)
+        filler.add(gdspy.Rectangle((0, 0), (1, 1), layer=2))
+        lib.add(filler)
+    # ROW is read before ELECTRODE, which it references, is defined
+    lib.add(row, include_dependencies=False)
+    lib.add(electrode)
+    lib.write_gds(str(tmp_path / 'MEA64.gds'))
+
+    name, shapes = gds_stream.read_shapes(str(tmp_path / 'MEA64.gds'))
+    assert name == 'MEA_64'
+    centers = shapes['boxes'].mean(axis=1)
+    assert len(np.unique(centers, axis=0)) == 64
+
+
+def assert_same_shapes(serial, sharded):
+    assert serial[0] == sharded[0]
+    for key in gds_stream.SHAPE_FIELDS:
+        np.testing.assert_array_equal(serial[1][key], sharded[1][key], err_msg=key)
+
+
+@pytest.mark.parametrize('workers', [2, 3, 7])
+def test_sharded_read_matches_serial_read(tmp_path, monkeypatch, workers):
+    path = hierarchical_layout(tmp_path / 'MEA.gds')
+    monkeypatch.setattr(gds_stream, 'SHARD_MIN_BYTES', 1024)
+    serial = gds_stream.read_shapes(path, layers=LAYERS)
+    assert_same_shapes(serial, gds_stream.read_shapes(path, layers=LAYERS, workers=workers))
+
+
+_read_shard = gds_stream._read_shard
+
+
+def recording_read_shard(infile, start, stop, layers, follow_references):
+    # only the calls made in the test process are recorded: the rescans
+    RESCANS.append(start)
+    return _read_shard(infile, start, stop, layers, follow_references)
+
+
+def test_shard_starting_on_coordinates_is_scanned_again(tmp_path, monkeypatch):
+    path = hierarchical_layout(tmp_path / 'MEA.gds', decoy=True)
+    with open(path, 'rb') as f:
+        data = f.read()
+    # the decoy point is the first one of an XY record, right after its record type
+    decoy = data.find(b'\x10\x03\x00\x04\x08\x00\x00\x06\x0d\x02') + 2
+    assert decoy > 2
+    starts = iter([decoy])
+    shard_start = gds_stream._shard_start
+    monkeypatch.setattr(gds_stream, '_shard_start', lambda mm, offset: next(starts, None) or shard_start(mm, offset))
+    monkeypatch.setattr(gds_stream, '_read_shard', recording_read_shard)
+    monkeypatch.setattr(gds_stream, 'SHARD_MIN_BYTES', 1024)
+    RESCANS.clear()
+
+    serial = gds_stream.read_shapes(path, layers=LAYERS)
+    sharded = gds_stream.read_shapes(path, layers=LAYERS, workers=3)
+    assert_same_shapes(serial, sharded)
+    # the shard before the decoy ran on to the next real element, where the rescan starts
+    assert len(RESCANS) == 1 and RESCANS[0] > decoy
+
+
+def gdspy_boxes(path, cell_name, layer):
+    '''
+    Bounding boxes of the polygons on layer of the flattened cell, as gdspy reads them, sorted.
+    '''
+    cell = gdspy.GdsLibrary(infile=path).cells[cell_name]
+    polygons = cell.get_polygons(by_spec=True).get((layer, 0), [])
+    return sorted_boxes(np.array([[p.min(axis=0), p.max(axis=0)] for p in polygons]).reshape(-1, 2, 2))
+
+
+def sorted_boxes(boxes):
+    # rounded for the order only, so float noise from the transforms does not reorder equal rows
+    flat = np.round(boxes.reshape(-1, 4), 6)
+    return boxes[np.lexsort(flat.T[::-1])]
+
+
+def assert_matches_gdspy(path, cell_name):
+    name, shapes = gds_stream.read_shapes(path, layers=LAYERS)
+    assert name == cell_name
+    for layer in LAYERS:
+        expected = gdspy_boxes(path, cell_name, layer)
+        np.testing.assert_allclose(sorted_boxes(shapes['boxes'][shapes['layer'] == layer]), expected,
+                                   atol=1e-9, err_msg=f'layer {layer}')
+
+
+def test_flat_cell_matches_gdspy(tmp_path):
+    before = gdspy.Cell('PADS', exclude_from_current=True)
+    before.add(gdspy.Rectangle((0, 0), (100, 100), layer=2))
+    mea = gdspy.Cell('MEA_FLAT', exclude_from_current=True)
+    rng = np.random.default_rng(0)
+    for x, y in rng.uniform(-5000, 5000, size=(200, 2)):
+        mea.add(gdspy.Round((x, y), 15, number_of_points=int(rng.choice([4, 6, 60, 64])), layer=2))
+    for x, y in rng.uniform(-5000, 5000, size=(20, 2)):
+        mea.add(gdspy.Rectangle((x, y), (x + 40.5, y + 12.25), layer=int(rng.choice([1, 3, 4]))))
+    after = gdspy.Cell('LEADS', exclude_from_current=True)
+    after.add(gdspy.Rectangle((0, 0), (1, 500), layer=2))
+    lib = gdspy.GdsLibrary()
+    lib.add([before, mea, after])
+    path = str(tmp_path / 'MEA_FLAT.gds')
+    lib.write_gds(path)
+    assert_matches_gdspy(path, 'MEA_FLAT')
+
+
+def test_references_match_flattened_gdspy(tmp_path):
+    assert_matches_gdspy(hierarchical_layout(tmp_path / 'MEA.gds'), 'MEA_TEST')
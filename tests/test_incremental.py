@@ -0,0 +1,33 @@
+import numpy as np
+import pytest
+
+from incremental import diff_electrodes
+from position_io import make_records
+from script import ExtractionResult
+from conftest import grid
+
+
+@pytest.mark.parametrize('columns, rows', [(13, 1), (25, 1), (27, 1), (1, 13), (16, 16), (7, 5)])
+def test_unchanged_layout_keeps_every_label(columns, rows):
+    # re-extracting a layout against its own previous output
+    centers = grid(columns, rows, 100.0)
+    previous = ExtractionResult(centers).records
+    labels, adjusted, _, diff = diff_electrodes(previous, centers)
+    assert diff['unchanged'] == len(centers)
+    assert diff['added'] == diff['removed'] == diff['moved'] == []
+    np.testing.assert_array_equal(np.sort(labels), previous['index'])
+    by_label = np.argsort(previous['index'])
+    np.testing.assert_array_equal(adjusted, np.column_stack((previous['x'], previous['y']))[by_label[labels]])
+
+
+def test_added_removed_and_moved():
+    centers = grid(8, 8, 100.0)
+    previous = make_records(centers)
+    current = np.concatenate((np.delete(centers, 5, axis=0), [[800.0, 0.0]]))
+    current[0] += 20.0
+    labels, _, _, diff = diff_electrodes(previous, current)
+    assert [row[0] for row in diff['removed']] == [5]
+    assert [row[0] for row in diff['added']] == [64]
+    assert [row[0] for row in diff['moved']] == [0]
+    assert diff['unchanged'] == 62
+    assert labels[-1] == 64
@@ -0,0 +1,26 @@
+import numpy as np
+import pytest
+
+from lattice import infer_lattice
+from conftest import grid
+
+
+@pytest.mark.parametrize('points, kind, shape', [
+    (grid(64, 1024, 17.5, 17.5), 'rect', (1024, 64)),
+    (grid(30, 20, 20.0, 17.32, hexagonal=True), 'hex', (20, 30)),
+    (grid(50, 1, 30.0, 1.0), 'rect', (1, 50)),
+    (grid(1, 40, 1.0, 25.0), 'rect', (40, 1)),
+    (grid(20, 10, 10.0, 40.0), 'rect', (10, 20)),
+    (grid(40, 2, 40.0, 10.0), 'rect', (2, 40)),
+])
+@pytest.mark.parametrize('noise', [0.0, 0.5])
+def test_infer_lattice_with_missing_points(points, kind, shape, noise):
+    rng = np.random.default_rng(0)
+    missing = rng.random(len(points)) < 0.1
+    missing[[0, -1]] = False
+    known = points[~missing] + rng.uniform(-noise, noise, (np.count_nonzero(~missing), 2))
+    lattice = infer_lattice(known)
+    assert lattice.kind == kind
+    assert lattice.shape == shape
+    assert np.count_nonzero(lattice.missing) == np.count_nonzero(missing)
+    np.testing.assert_allclose(lattice.sites[lattice.known_index], known, atol=2 * noise + 1e-9)
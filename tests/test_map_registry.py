@@ -0,0 +1,14 @@
+import numpy as np
+
+from map_registry import _sidecar_path, load_map
+
+
+def test_truncated_sidecar_is_reparsed(tmp_path):
+    csv = tmp_path / 'pair_old.csv'
+    csv.write_text('1,2\n3,4\n')
+    expected = load_map(csv)
+    sidecar = _sidecar_path(csv)
+    assert sidecar.exists()
+    sidecar.write_bytes(sidecar.read_bytes()[:30])
+    np.testing.assert_array_equal(load_map(csv), expected)
+    assert sidecar.exists()
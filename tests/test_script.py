@@ -0,0 +1,19 @@
+import gdspy
+import numpy as np
+
+import script
+from conftest import grid
+
+
+def test_visualization_gds_keeps_recording_lattice_in_one_array(tmp_path):
+    recording = grid(10, 10, 100.0)
+    stimulus = np.array([[-300.0, -300.0], [1200.0, -250.0], [-300.0, 1200.0], [1300.0, 1200.0]])
+    positions = np.concatenate((recording, stimulus))
+    mask = np.r_[np.zeros(len(recording), dtype=bool), np.ones(len(stimulus), dtype=bool)]
+    script.write_visualization_gds(positions, 'MEA104', output_dir=tmp_path, stimulus_mask=mask)
+
+    cell = gdspy.GdsLibrary(infile=str(tmp_path / 'electrode_positions_MEA104.gds')).cells['Electrode_Positions']
+    arrays = [ref for ref in cell.references if isinstance(ref, gdspy.CellArray)]
+    single = [ref for ref in cell.references if not isinstance(ref, gdspy.CellArray)]
+    assert len(arrays) == 1 and (arrays[0].columns, arrays[0].rows) == (10, 10)
+    assert len(single) == len(stimulus)
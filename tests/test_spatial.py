@@ -0,0 +1,72 @@
+import numpy as np
+import pytest
+
+from spatial import ElectrodeIndex
+from conftest import grid
+
+
+LAYOUTS = {
+    'line_1x9': grid(9, 1, 30.0),
+    'column_9x1': grid(1, 9, 30.0),
+    'grid_6x6': grid(6, 6, 20.0),
+    'grid_13x4': grid(13, 4, 17.5),
+    'random': np.random.default_rng(0).uniform(-500, 500, (300, 2)),
+    'duplicates': np.repeat(grid(3, 3, 10.0), 2, axis=0),
+}
+
+
+def brute_distances(positions, queries):
+    return np.hypot(*(queries[:, None, :] - positions[None, :, :]).transpose(2, 0, 1))
+
+
+@pytest.fixture(params=sorted(LAYOUTS))
+def positions(request):
+    return LAYOUTS[request.param]
+
+
+def queries_for(positions):
+    rng = np.random.default_rng(1)
+    lower, upper = positions.min(axis=0), positions.max(axis=0)
+    margin = (upper - lower).max() + 1.0
+    outside = rng.uniform(lower - margin, upper + margin, (50, 2))
+    return np.concatenate((positions, outside))
+
+
+def test_nearest_matches_brute_force(positions):
+    index = ElectrodeIndex(positions, method='grid')
+    queries = queries_for(positions)
+    d, labels = index.nearest(queries, k=3)
+    expected = np.sort(brute_distances(positions, queries), axis=1)[:, :3]
+    np.testing.assert_allclose(d, expected)
+    np.testing.assert_allclose(np.hypot(*(positions[labels] - queries[:, None, :]).transpose(2, 0, 1)), d)
+
+
+def test_nearest_finds_every_electrode_itself():
+    positions = LAYOUTS['line_1x9']
+    d, labels = ElectrodeIndex(positions, method='grid').nearest(positions)
+    np.testing.assert_array_equal(labels, np.arange(len(positions)))
+    np.testing.assert_array_equal(d, 0)
+
+
+def test_within_radius_matches_brute_force(positions):
+    index = ElectrodeIndex(positions, method='grid')
+    queries = queries_for(positions)
+    radius = 0.3 * (positions.max(axis=0) - positions.min(axis=0)).max() + 1.0
+    query, labels, d = index.within_radius(queries, radius)
+    q, e = np.nonzero(brute_distances(positions, queries) <= radius)
+    assert sorted(zip(query.tolist(), labels.tolist())) == sorted(zip(q.tolist(), e.tolist()))
+    assert (np.diff(query) >= 0).all()
+
+
+def test_within_box_matches_brute_force(positions):
+    index = ElectrodeIndex(positions, method='grid')
+    lower, upper = positions.min(axis=0), positions.max(axis=0)
+    query, labels = index.within_box(lower, upper)
+    assert sorted(labels.tolist()) == list(range(len(positions)))
+
+    rng = np.random.default_rng(2)
+    corners = np.sort(rng.uniform(lower - 10, upper + 10, (2, 40, 2)), axis=0)
+    query, labels = index.within_box(corners[0], corners[1])
+    inside = ((positions[None] >= corners[0][:, None]) & (positions[None] <= corners[1][:, None])).all(axis=2)
+    q, e = np.nonzero(inside)
+    assert sorted(zip(query.tolist(), labels.tolist())) == sorted(zip(q.tolist(), e.tolist()))